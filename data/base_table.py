@@ -0,0 +1,378 @@
+import numpy as np
+import pandas as pd
+
+from elo import calculate_elo, EloState
+from names import NameCache, normalise_names
+from score_states import SCORE_STATE_TABLE, PLAYER_COLUMNS, update_score_states, winrate_summary
+
+TOURNAMENT_CATEGORIES = ('ATP', 'WTA', 'Challenger', 'ITF Men', 'ITF Women', 'WTA 125')
+FINISHED_STATUSES = ('Ended', 'Retired', 'Walkover', 'Defaulted', 'Player 2 defaulted, player 1 won')
+
+ROUND_CATEGORIES = {
+    'Qualification': ['Qualification', 'Qualification round', 'Qualification round 1',
+                      'Qualification round 2', 'Qualification Final'],
+    'Final': ['Final'],
+    '3rd place': ['Match for 3rd place'],
+    'Semifinals': ['Semifinals'],
+    'Quarterfinals': ['Quarterfinals'],
+    'Middle Stages': ['Round of 32', 'Round of 16', '1/16-finals (R32)', '1/8-finals (R16)'],
+    'Early Stages': ['Round of 64', 'Round of 128', '1/32-finals (R64)', '1/64-finals (R128)', 'R128']
+}
+
+SOFASCORE_COLUMNS = ['id', 'groundType', 'tournament_name', 'tournament_category', 'tournament_points',
+                     'tournament_round_category', 'home_winner', 'away_winner',
+                     'home_score_period1', 'home_score_period2', 'home_score_period3', 'home_score_period4',
+                     'home_score_period5',
+                     'away_score_period1', 'away_score_period2', 'away_score_period3', 'away_score_period4',
+                     'away_score_period5',
+                     'datetime', 'home_clean_name', 'away_clean_name', 'match_status']
+
+MARKET_COLUMNS = ['index', 'id', 'market_id', 'selection_id', 'result', 'pp_min', 'pp_max', 'pp_wap', 'pp_ltp',
+                  'pp_volume', 'ip_min', 'ip_max', 'ip_wap', 'ip_ltp', 'ip_volume']
+
+# Match stats stored as "won/attempted (pct)" strings
+RATIO_STAT_COLUMNS = ['breakPointsSaved', 'firstReturnPoints', 'firstServeAccuracy', 'firstServePointsAccuracy',
+                      'secondReturnPoints', 'secondServeAccuracy', 'secondServePointsAccuracy']
+
+TENNIS_MARKETS_SQL = """
+SELECT *
+
+FROM competition_mappings c
+INNER JOIN market_summaries m
+ON c.market_id = m.market_id
+"""
+
+SOFASCORE_EVENTS_SQL = f"""
+SELECT *
+FROM sofascore_events
+WHERE tournament_category IN {TOURNAMENT_CATEGORIES}
+AND match_status IN {FINISHED_STATUSES}
+AND winnerCode IN (1,2)
+"""
+
+MATCH_STATS_SQL = """
+SELECT match_id, key, home, away
+FROM sofascore_match_stats
+WHERE period = 'ALL'
+"""
+
+
+# Function to safely split the string
+def safe_split(x):
+    parts = str(x).split('/', 1)
+    return parts + [np.nan] * (2 - len(parts))
+
+
+def table_exists(con, name):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [name]
+    ).fetchone()[0] > 0
+
+
+def load_sources(con, event_ids=None, market_ids=None):
+    """Markets, finished SofaScore events and match stats, optionally only for the given ids."""
+    if event_ids is None:
+        return (con.execute(TENNIS_MARKETS_SQL).df(),
+                con.execute(SOFASCORE_EVENTS_SQL).df(),
+                con.execute(MATCH_STATS_SQL).df())
+
+    con.register('load_event_ids', pd.DataFrame({'id': event_ids}))
+    con.register('load_market_ids', pd.DataFrame({'market_id': market_ids}))
+    tennis_markets = con.execute(f"""
+        SELECT * FROM ({TENNIS_MARKETS_SQL}) t
+        WHERE t.market_id IN (SELECT market_id FROM load_market_ids)
+    """).df()
+    sofascore_events = con.execute(f"""
+        SELECT * FROM ({SOFASCORE_EVENTS_SQL}) e
+        WHERE CAST(e.id AS BIGINT) IN (SELECT id FROM load_event_ids)
+    """).df()
+    match_stats_raw = con.execute(f"""
+        SELECT * FROM ({MATCH_STATS_SQL}) s
+        WHERE CAST(s.match_id AS BIGINT) IN (SELECT id FROM load_event_ids)
+    """).df()
+    con.unregister('load_event_ids')
+    con.unregister('load_market_ids')
+    return tennis_markets, sofascore_events, match_stats_raw
+
+
+def prepare_markets(tennis_markets, excluded_selection_names, name_cache=None):
+    tennis_markets = tennis_markets[~tennis_markets['selection_name'].str.contains("/")]
+    tennis_markets = tennis_markets[~tennis_markets['selection_name'].isin(excluded_selection_names)].copy()
+    tennis_markets['bf_name'] = normalise_names(tennis_markets['selection_name'], cache=name_cache)
+    tennis_markets['FORMATTED_DATE'] = pd.to_datetime(tennis_markets['FORMATTED_DATE'])
+    return tennis_markets
+
+
+def prepare_events(sofascore_events, name_cache=None):
+    sofascore_events = sofascore_events[~sofascore_events['home_team'].str.contains('/')]
+    sofascore_events = sofascore_events[~sofascore_events['away_team'].str.contains('/')]
+    sofascore_events = sofascore_events[sofascore_events['match_status'] != 'Not started'].copy()
+    sofascore_events['event_fetch_date'] = pd.to_datetime(sofascore_events['event_fetch_date'])
+    sofascore_events['home_clean_name'] = normalise_names(sofascore_events['home_team_slug'], 1, cache=name_cache)
+    sofascore_events['away_clean_name'] = normalise_names(sofascore_events['away_team_slug'], 1, cache=name_cache)
+    sofascore_events['id'] = sofascore_events['id'].astype(int)
+    sofascore_events.loc[
+        sofascore_events['match_status'] == 'Player 2 defaulted, player 1 won', 'match_status'] = 'Defaulted'
+
+    sofascore_events['home_winner'] = 0
+    sofascore_events.loc[sofascore_events['winnerCode'] == 1, 'home_winner'] = 1
+    sofascore_events['away_winner'] = 0
+    sofascore_events.loc[sofascore_events['winnerCode'] == 2, 'away_winner'] = 1
+
+    # Create a flat dictionary for efficient mapping
+    flat_mapping = {round_name: category
+                    for category, rounds in ROUND_CATEGORIES.items()
+                    for round_name in rounds}
+    sofascore_events['tournament_round_category'] = sofascore_events['tournament_round'].map(flat_mapping).fillna(
+        'Other')
+    return sofascore_events
+
+
+def unpivot_events(sofascore_events, player_name_mapping):
+    sofascore_events_base = sofascore_events[SOFASCORE_COLUMNS].copy()
+
+    # Define the columns to pivot
+    home_columns = [col for col in sofascore_events_base.columns if col.startswith('home_')]
+    away_columns = [col for col in sofascore_events_base.columns if col.startswith('away_')]
+    common_columns = [col for col in sofascore_events_base.columns if
+                      not col.startswith('home_') and not col.startswith('away_')]
+    home_df = sofascore_events_base[common_columns + home_columns].copy()
+    home_df['position'] = 'home'
+    home_df.columns = [col.replace('home_', '') if col.startswith('home_') else col for col in home_df.columns]
+    away_df = sofascore_events_base[common_columns + away_columns].copy()
+    away_df['position'] = 'away'
+    away_df.columns = [col.replace('away_', '') if col.startswith('away_') else col for col in away_df.columns]
+
+    unpiv = pd.concat([home_df, away_df], ignore_index=True)
+    unpiv = unpiv.sort_values(['id', 'position'])
+    unpiv = unpiv.reset_index(drop=True)
+    unpiv = unpiv.merge(player_name_mapping, left_on='clean_name', right_on='name', how='left').drop(columns='name')
+    unpiv.loc[unpiv['index'].isna(), 'index'] = -1
+    unpiv['index'] = unpiv['index'].astype(int)
+    return unpiv
+
+
+def match_markets(tennis_markets, market_match_mapping, player_name_mapping):
+    bf_matched_tennis_markets = tennis_markets.merge(market_match_mapping, on='market_id').query("result != 'REMOVED'")
+    summed_volumes = bf_matched_tennis_markets.groupby(['market_id', 'id'])['pp_volume'].sum().reset_index()
+    # Now, select the rows with maximum pp_volume for each market_id
+    max_market_vols = summed_volumes.loc[summed_volumes.groupby('id')['pp_volume'].idxmax()]
+
+    bf_matched_tennis_markets = bf_matched_tennis_markets.merge(max_market_vols[['market_id', 'id']],
+                                                                on=['market_id', 'id'])
+    bf_matched_tennis_markets = bf_matched_tennis_markets.merge(player_name_mapping, left_on='bf_name',
+                                                                right_on='name').drop(columns='name')
+    return bf_matched_tennis_markets[MARKET_COLUMNS].copy()
+
+
+def pivot_match_stats(match_stats_raw):
+    # Melt the dataframe to create separate rows for home and away
+    match_stats = pd.melt(match_stats_raw, id_vars=['match_id', 'key'],
+                          value_vars=['home', 'away'],
+                          var_name='team', value_name='value')
+    # Pivot the data
+    match_stats = match_stats.pivot_table(values='value',
+                                          index=['match_id', 'team'],
+                                          columns='key', aggfunc='first')
+
+    # Reset index to make match_id, period, and team regular columns
+    match_stats.reset_index(inplace=True)
+    match_stats.columns.name = None
+    match_stats['match_id'] = match_stats['match_id'].astype(int)
+    return match_stats
+
+
+def split_ratio_stats(base_table):
+    for col in [x for x in RATIO_STAT_COLUMNS if x in base_table.columns]:
+        # Apply the safe split function
+        base_table[[f'{col}', f'{col}Attempted']] = base_table[col].apply(safe_split).tolist()
+
+        # Clean up the 'backhandWinners_attempted' column
+        base_table[f'{col}Attempted'] = base_table[f'{col}Attempted'].str.split().str[0]
+
+        # Convert to numeric, coercing errors to NaN
+        base_table[f'{col}'] = pd.to_numeric(base_table[f'{col}'], errors='coerce')
+        base_table[f'{col}Attempted'] = pd.to_numeric(base_table[f'{col}Attempted'], errors='coerce')
+    return base_table
+
+
+def assemble_base_table(tennis_markets, sofascore_events, match_stats_raw, excluded_selection_names,
+                        player_name_mapping, market_match_mapping, name_cache=None):
+    tennis_markets = prepare_markets(tennis_markets, excluded_selection_names, name_cache)
+    sofascore_events = prepare_events(sofascore_events, name_cache)
+
+    base_table = unpivot_events(sofascore_events, player_name_mapping)
+    base_table = base_table.merge(match_markets(tennis_markets, market_match_mapping, player_name_mapping),
+                                  on=['index', 'id'], how='left')
+    base_table = base_table.merge(pivot_match_stats(match_stats_raw), left_on=['id', 'position'],
+                                  right_on=['match_id', 'team'], how='left')
+    base_table.drop(columns=['match_id', 'team'], inplace=True)
+    return split_ratio_stats(base_table)
+
+
+def pbp_summary(con, new_players):
+    """
+    Point-by-point win rate summary for the players in new_players, from the score-state
+    history as of each match's start. Their points are added to the history first.
+    """
+    update_score_states(con, new_players)
+    df_summ = winrate_summary(con, new_players)
+    df_summ['id'] = df_summ['id'].astype(int)
+    return df_summ
+
+
+def get_watermark(con):
+    if not table_exists(con, 'base_table_watermark'):
+        return None
+    row = con.execute("SELECT max_datetime FROM base_table_watermark").fetchone()
+    return row[0] if row else None
+
+
+def get_mapping_watermark(con):
+    """
+    Latest market_match_mapping.mapped_at the last build saw, or the time of that build when
+    it saw none (or its watermark table predates the column).
+    """
+    columns = [x[0] for x in con.execute("DESCRIBE base_table_watermark").fetchall()]
+    mapped_at = 'max_mapped_at' if 'max_mapped_at' in columns else 'NULL'
+    row = con.execute(f"SELECT coalesce({mapped_at}, updated_at) FROM base_table_watermark").fetchone()
+    return row[0] if row else None
+
+
+def save_state(con, elo_state, watermark, mapping_watermark=None):
+    elo_state_df = elo_state.to_frame()
+    con.execute("CREATE OR REPLACE TABLE elo_state AS SELECT * FROM elo_state_df")
+    con.execute("CREATE OR REPLACE TABLE base_table_watermark "
+                "(max_datetime TIMESTAMP, max_mapped_at TIMESTAMP, updated_at TIMESTAMP)")
+    con.execute("INSERT INTO base_table_watermark VALUES (?, ?, now())", [watermark, mapping_watermark])
+
+
+def new_event_ids(con, watermark, lookback_days):
+    """Finished events not yet in base_table, starting lookback_days before the watermark."""
+    return con.execute(f"""
+        SELECT DISTINCT CAST(e.id AS BIGINT) AS id
+        FROM ({SOFASCORE_EVENTS_SQL}) e
+        WHERE e.datetime > ?::TIMESTAMP - INTERVAL {int(lookback_days)} DAY
+        AND CAST(e.id AS BIGINT) NOT IN (SELECT id FROM base_table)
+    """, [watermark]).df()['id'].tolist()
+
+
+def remapped_event_ids(con, market_match_mapping, mapping_watermark):
+    """Events already in base_table with market_match_mapping rows added after mapping_watermark."""
+    if 'mapped_at' not in market_match_mapping or mapping_watermark is None:
+        return []
+    ids = market_match_mapping.loc[market_match_mapping['mapped_at'] > mapping_watermark, 'id'].unique()
+    con.register('remapped_ids', pd.DataFrame({'id': ids.astype(np.int64)}))
+    ids = con.execute("SELECT DISTINCT id FROM base_table WHERE id IN (SELECT id FROM remapped_ids)").df()['id']
+    con.unregister('remapped_ids')
+    return ids.tolist()
+
+
+def refresh_markets(con, event_ids, excluded_selection_names, player_name_mapping, market_match_mapping,
+                    name_cache=None):
+    """
+    Replace the market columns of the base_table rows of event_ids with their current market
+    mapping. Nothing else of those rows changes, so Elo and the score-state history, which
+    already count the matches, are left alone. Runs inside build_base_table's transaction.
+    """
+    market_ids = market_match_mapping.loc[market_match_mapping['id'].isin(event_ids), 'market_id']
+    tennis_markets = load_sources(con, event_ids, market_ids.unique().tolist())[0]
+    markets = match_markets(prepare_markets(tennis_markets, excluded_selection_names, name_cache),
+                            market_match_mapping, player_name_mapping)
+    existing_columns = [x[0] for x in con.execute("DESCRIBE base_table").fetchall()]
+    columns = [x for x in MARKET_COLUMNS if x not in ['index', 'id'] and x in existing_columns]
+
+    con.register('refresh_ids', pd.DataFrame({'id': np.asarray(event_ids, dtype=np.int64)}))
+    con.register('refreshed_markets', markets)
+    con.execute(f"""
+        UPDATE base_table SET {', '.join(f'"{x}" = NULL' for x in columns)}
+        WHERE id IN (SELECT id FROM refresh_ids)
+    """)
+    con.execute(f"""
+        UPDATE base_table SET {', '.join(f'"{x}" = m."{x}"' for x in columns)}
+        FROM refreshed_markets m
+        WHERE base_table.id = m.id AND base_table."index" = m."index"
+    """)
+    con.unregister('refreshed_markets')
+    con.unregister('refresh_ids')
+
+
+def build_base_table(con, excluded_selection_names, player_name_mapping, market_match_mapping,
+                     incremental=True, lookback_days=7, k_factor=32):
+    """
+    Build or refresh base_table in the DuckDB connection.
+
+    The first run (or incremental=False) rebuilds the table from scratch. After that only
+    finished events not yet in base_table, from lookback_days before the stored watermark
+    onwards, are processed: Elo continues from the saved elo_state and the new rows are
+    upserted by match id. Events backfilled further in the past need a full rebuild. Only the
+    new matches' points are added to the score-state history behind the win rate summary.
+
+    Events already in base_table whose markets were mapped since the last build (by
+    market_match_mapping's mapped_at, when the frame has it) get their market columns
+    refreshed, as the mapping can arrive after the event was written. Returns the number of
+    rows written, not counting refreshed ones.
+    """
+    watermark = get_watermark(con) if incremental and table_exists(con, 'base_table') else None
+    mapped_at = market_match_mapping['mapped_at'].max() if 'mapped_at' in market_match_mapping else None
+    mapping_watermark = None if pd.isna(mapped_at) else mapped_at
+
+    name_cache = NameCache()
+    if watermark is None:
+        elo_state = EloState()
+        sources = load_sources(con)
+        remapped_ids = []
+    else:
+        elo_state = EloState.from_frame(con.execute("SELECT * FROM elo_state").df())
+        event_ids = new_event_ids(con, watermark, lookback_days)
+        remapped_ids = remapped_event_ids(con, market_match_mapping, get_mapping_watermark(con))
+        if not event_ids and not remapped_ids:
+            return 0
+        market_ids = market_match_mapping.loc[market_match_mapping['id'].isin(event_ids), 'market_id']
+        sources = load_sources(con, event_ids, market_ids.unique().tolist()) if event_ids else None
+
+    base_table = pd.DataFrame()
+    if sources is not None:
+        base_table = assemble_base_table(*sources, excluded_selection_names, player_name_mapping,
+                                         market_match_mapping, name_cache)
+    if base_table.empty and not remapped_ids:
+        name_cache.save()
+        return 0
+
+    new_watermark = watermark
+    if not base_table.empty:
+        base_table = base_table.assign(**calculate_elo(base_table, k_factor=k_factor, state=elo_state))
+        new_watermark = base_table['datetime'].max() if watermark is None else max(watermark, base_table['datetime'].max())
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        # The score-state history is written with base_table so a match is never counted twice
+        if watermark is None:
+            con.execute(f"DROP TABLE IF EXISTS {SCORE_STATE_TABLE}")
+        elif not table_exists(con, SCORE_STATE_TABLE):
+            update_score_states(con, con.execute(f"SELECT {', '.join(PLAYER_COLUMNS)} FROM base_table").df())
+
+        if watermark is None:
+            base_table = base_table.merge(pbp_summary(con, base_table), on=['id', 'index'], how='left')
+            con.register('new_base_table', base_table)
+            con.execute("CREATE OR REPLACE TABLE base_table AS SELECT * FROM new_base_table")
+            con.unregister('new_base_table')
+        elif not base_table.empty:
+            base_table = base_table.merge(pbp_summary(con, base_table), on=['id', 'index'], how='left')
+            existing_columns = [x[0] for x in con.execute("DESCRIBE base_table").fetchall()]
+            base_table = base_table[[x for x in base_table.columns if x in existing_columns]]
+            con.register('new_base_table', base_table)
+            con.execute("DELETE FROM base_table WHERE id IN (SELECT DISTINCT id FROM new_base_table)")
+            con.execute("INSERT INTO base_table BY NAME SELECT * FROM new_base_table")
+            con.unregister('new_base_table')
+        if remapped_ids:
+            refresh_markets(con, remapped_ids, excluded_selection_names, player_name_mapping, market_match_mapping,
+                            name_cache)
+        save_state(con, elo_state, new_watermark, mapping_watermark)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    name_cache.save()
+
+    return len(base_table)
@@ -3,7 +3,6 @@ import logging
 import time
 import smart_open
 import pandas as pd
-import math
 import duckdb
 from betfairlightweight.resources import MarketBook
 from flumine.markets.market import Market
@@ -12,7 +11,9 @@ from pythonjsonlogger import jsonlogger
 from unittest.mock import patch
 from flumine import utils, clients, FlumineSimulation
 from flumine import BaseStrategy
-from concurrent import futures
+
+from job_ledger import JobLedger, run_ledger
+from market_catalog import market_files
 
 logger = logging.getLogger()
 
@@ -88,59 +89,44 @@ def run_process(markets, output_file):
     except Exception as e:
         # Catch any other unexpected exceptions
         logger.error(f"Unexpected error in run_process: {e}")
+        raise
+
+
+def run_job(job_id, markets):
+    output_file = f"price-processing/output_job_{job_id}.csv"  # Each job gets its own output file
+    # A retried job starts its output again
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    run_process(markets, output_file)
 
 
 # Multi processing
 if __name__ == "__main__":
-    # Fetch distinct market IDs
+    # Fetch distinct market IDs and their files from the market catalog (see market_catalog.py)
     con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
     market_ids = set(con.execute("SELECT DISTINCT(market_id) FROM base_table WHERE market_id IS NOT NULL").df()[
                          'market_id'].tolist())
+    data_files = market_files(con, market_ids)
     con.close()
 
-    # Scan directory for files
-    data_files = []
-    directory = 'E:/Data/tennis/betfair-market-files/'
-
-    for dirpath, _, filenames in os.walk(directory):
-        for filename in filenames:
-            if filename.endswith(".bz2"):
-                market_id = os.path.splitext(filename)[0]  # Strip .bz2 extension
-                if market_id in market_ids:
-                    data_files.append(os.path.join(dirpath, filename))
-
-    # Sort files
-    data_files = sorted(data_files, key=os.path.basename)
-
     # All the markets we want to simulate
     processes = os.cpu_count() - 1  # Returns the number of CPUs in the system.
     markets_per_process = 8  # 8 is optimal as it prevents data leakage.
 
-    _process_jobs = []
-    output_files = []
-
-    with futures.ProcessPoolExecutor(max_workers=processes) as p:
-        # Number of chunks to split the process into depends on the number of markets we want to process and number of CPUs we have.
-        chunk = min(markets_per_process, math.ceil(len(data_files) / processes))
-
-        # Split all the markets we want to process into chunks to run on separate CPUs and then run them on the separate CPUs
-        for i, process_chunks in enumerate(utils.chunks(data_files, chunk * processes)):
-            output_file = f"price-processing/output_process_{i}.csv"  # Each process gets its own output file
-            output_files.append(output_file)
-
-            # Submit all chunks for this process as a single job
-            _process_jobs.append(
-                p.submit(
-                    run_process,
-                    markets=process_chunks,
-                    output_file=output_file
-                )
-            )
+    # Jobs of consecutive markets, split further by file size so a run of Grand Slam files does not
+    # end up as one long job. The ledger keeps finished jobs, so a rerun only does the rest, and
+    # other hosts can work through the same ledger on a shared drive
+    os.makedirs("price-processing", exist_ok=True)
+    ledger = JobLedger("price-processing/jobs.sqlite")
+    max_bytes = sum(os.path.getsize(f) for f in data_files) // (processes * 4) or None
+    ledger.add(data_files, max_markets=markets_per_process, max_bytes=max_bytes)
 
-        for job in futures.as_completed(_process_jobs):
-            job.result()  # wait for result
+    run_ledger(ledger.path, run_job, workers=processes)
+    print(ledger.progress())
 
     # Combine all the output CSVs into a single DataFrame
+    output_files = [f"price-processing/output_job_{job_id}.csv" for job_id in ledger.done_jobs()]
+    ledger.close()
     final_df = pd.concat([pd.read_csv(f) for f in output_files if os.path.exists(f)], ignore_index=True)
 
     # Save the combined result to a final CSV
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+
+# Elo systems calculated alongside the overall rating, keyed by output suffix
+DEFAULT_SYSTEMS = {
+    'surface': 'groundType',
+    'category': 'tournament_category',
+}
+
+
+def constant_k_factor(k_factor=32):
+    return lambda matches_played: k_factor
+
+
+def decaying_k_factor(k_max=250, offset=5, shape=0.4):
+    # K shrinks as a player accumulates matches (FiveThirtyEight style)
+    return lambda matches_played: k_max / (matches_played + offset) ** shape
+
+
+class EloState:
+    """Current rating and number of matches played per key for every Elo system."""
+
+    def __init__(self):
+        self.ratings = {}
+        self.played = {}
+
+    def system(self, name):
+        return self.ratings.setdefault(name, {}), self.played.setdefault(name, {})
+
+    def to_frame(self):
+        rows = []
+        for name, ratings in self.ratings.items():
+            played = self.played[name]
+            for key, rating in ratings.items():
+                player, group = key if isinstance(key, tuple) else (key, None)
+                rows.append((name, player, group, rating, played[key]))
+        return pd.DataFrame(rows, columns=['system', 'player', 'group_value', 'rating', 'matches_played'])
+
+    @classmethod
+    def from_frame(cls, df):
+        state = cls()
+        for name, player, group, rating, played in df[
+                ['system', 'player', 'group_value', 'rating', 'matches_played']].itertuples(index=False):
+            key = int(player) if pd.isna(group) else (int(player), group)
+            ratings, matches = state.system(name)
+            ratings[key] = float(rating)
+            matches[key] = int(played)
+        return state
+
+
+def run_elo(player1, player2, player1_won, ratings, played, k_factor=32):
+    """
+    Sequential Elo update over integer-encoded matches.
+
+    player1, player2 index into ratings / played, which are updated in place. Returns the
+    pre- and post-match ratings of both players as NumPy arrays.
+    """
+    schedule = k_factor if callable(k_factor) else None
+    n = len(player1)
+    pre1, pre2 = [0.0] * n, [0.0] * n
+    post1, post2 = [0.0] * n, [0.0] * n
+
+    for i, (p1, p2, won) in enumerate(zip(player1.tolist(), player2.tolist(), player1_won.tolist())):
+        rating1 = ratings[p1]
+        rating2 = ratings[p2]
+        expected_score1 = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+
+        if schedule is None:
+            k1 = k2 = k_factor
+        else:
+            k1 = schedule(played[p1])
+            k2 = schedule(played[p2])
+
+        score1 = 1.0 if won else 0.0
+        new_rating1 = rating1 + k1 * (score1 - expected_score1)
+        new_rating2 = rating2 + k2 * ((1.0 - score1) - (1.0 - expected_score1))
+
+        ratings[p1] = new_rating1
+        ratings[p2] = new_rating2
+        played[p1] += 1
+        played[p2] += 1
+
+        pre1[i], pre2[i] = rating1, rating2
+        post1[i], post2[i] = new_rating1, new_rating2
+
+    return np.array(pre1), np.array(pre2), np.array(post1), np.array(post2)
+
+
+def pair_matches(df, player_col='index', match_col='id', winner_col='winner', time_col='datetime'):
+    """
+    Order a two-rows-per-match table by time then match id and split it into side arrays.
+
+    Returns the row positions of the first and second player of every match (into df),
+    plus whether the first player won.
+    """
+    match_ids = df[match_col].to_numpy()
+    order = np.lexsort((np.arange(len(df)), match_ids, df[time_col].to_numpy()))
+
+    if len(order) % 2:
+        raise ValueError("Base table has an odd number of rows")
+
+    first, second = order[0::2], order[1::2]
+    mismatched = match_ids[first] != match_ids[second]
+    if mismatched.any():
+        raise ValueError(f"Match {match_ids[first][mismatched][0]} does not have exactly 2 players")
+
+    winners = df[winner_col].to_numpy()
+    if (winners[first] + winners[second] != 1).any():
+        bad = match_ids[first][winners[first] + winners[second] != 1][0]
+        raise ValueError(f"Match {bad} does not have exactly 1 winner")
+
+    return first, second, winners[first] == 1
+
+
+def calculate_elo(df, k_factor=32, initial_rating=1500, systems=DEFAULT_SYSTEMS, state=None,
+                  player_col='index', match_col='id', winner_col='winner', time_col='datetime'):
+    """
+    Overall Elo plus one Elo per entry in systems (player rating within e.g. each surface),
+    all in a single chronological pass over the base table.
+
+    k_factor is a number, a schedule taking matches played, or a dict of those keyed by
+    system name ('overall' for the main rating). Passing an EloState continues from (and
+    updates) previously calculated ratings. Returns a dict of NumPy columns aligned with
+    the rows of df: pre_match_elo, post_match_elo, pre_match_elo_<system>, ...
+    """
+    if state is None:
+        state = EloState()
+
+    first, second, first_won = pair_matches(df, player_col, match_col, winner_col, time_col)
+    players = df[player_col].to_numpy()
+    n_matches = len(first)
+
+    columns = {}
+    for name, group_col in {'overall': None, **systems}.items():
+        if group_col is None:
+            keys = pd.Index(players)
+        else:
+            groups = df[group_col].fillna('Unknown').to_numpy()
+            keys = pd.MultiIndex.from_arrays([players, groups])
+        codes, uniques = pd.factorize(keys)
+        uniques = [int(x) for x in uniques] if group_col is None else [(int(p), g) for p, g in uniques]
+
+        known_ratings, known_played = state.system(name)
+        ratings = [known_ratings.get(key, initial_rating) for key in uniques]
+        played = [known_played.get(key, 0) for key in uniques]
+
+        system_k = k_factor.get(name, 32) if isinstance(k_factor, dict) else k_factor
+        pre_first, pre_second, post_first, post_second = run_elo(
+            codes[first], codes[second], first_won, ratings, played, system_k
+        )
+
+        for key, rating, matches in zip(uniques, ratings, played):
+            known_ratings[key] = rating
+            known_played[key] = matches
+
+        suffix = '' if group_col is None else f'_{name}'
+        pre = np.empty(2 * n_matches)
+        post = np.empty(2 * n_matches)
+        pre[first], pre[second] = pre_first, pre_second
+        post[first], post[second] = post_first, post_second
+        columns[f'pre_match_elo{suffix}'] = pre
+        columns[f'post_match_elo{suffix}'] = post
+
+    return columns
@@ -0,0 +1,203 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# A running job whose worker has not reported in this long is handed to another worker
+HEARTBEAT_SECONDS = 60
+STALE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+# No WAL, which needs shared memory and so does not work on a network filesystem
+LEDGER_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    bytes INTEGER,
+    status TEXT DEFAULT 'pending',
+    worker TEXT,
+    heartbeat REAL,
+    attempts INTEGER DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    path TEXT PRIMARY KEY,
+    job_id INTEGER,
+    position INTEGER
+);
+"""
+
+
+def plan_jobs(files, max_markets=8, max_bytes=None):
+    """
+    Split (path, size) pairs into jobs of consecutive files, so markets that ran together
+    before still do, each with at most max_markets files and, unless it is a single file,
+    at most max_bytes of them.
+    """
+    jobs, job, job_bytes = [], [], 0
+    for path, size in files:
+        if job and (len(job) == max_markets or (max_bytes is not None and job_bytes + size > max_bytes)):
+            jobs.append((job, job_bytes))
+            job, job_bytes = [], 0
+        job.append(path)
+        job_bytes += size
+    if job:
+        jobs.append((job, job_bytes))
+    return jobs
+
+
+class JobLedger:
+    """
+    Jobs of market files in a SQLite file that any number of worker processes, on this host
+    or others sharing the filesystem, claim work from. Finished jobs stay done across runs.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.con = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.con.executescript(LEDGER_SQL)
+
+    def close(self):
+        self.con.close()
+
+    def _transaction(self):
+        # Takes the write lock up front, so two workers can not claim the same job
+        self.con.execute("BEGIN IMMEDIATE")
+
+    def add(self, paths, max_markets=8, max_bytes=None):
+        """Plan the paths not yet in the ledger into jobs (see plan_jobs); returns the number of jobs added."""
+        self._transaction()
+        try:
+            known = {row[0] for row in self.con.execute("SELECT path FROM job_files")}
+            files = [(path, os.path.getsize(path)) for path in paths if path not in known]
+            jobs = plan_jobs(files, max_markets, max_bytes)
+            for job, job_bytes in jobs:
+                job_id = self.con.execute("INSERT INTO jobs (bytes) VALUES (?)", (job_bytes,)).lastrowid
+                self.con.executemany("INSERT INTO job_files VALUES (?, ?, ?)",
+                                     [(path, job_id, position) for position, path in enumerate(job)])
+            self.con.execute("COMMIT")
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+        return len(jobs)
+
+    def claim(self, worker):
+        """
+        The largest job still to do, as (job_id, paths), or None when there is none. Stale
+        running jobs count as still to do, unless they have had MAX_ATTEMPTS already: a job
+        that takes its worker down never reaches fail(), so those are marked failed here.
+        Handing out the big files first keeps them from being left to run on their own at the end.
+        """
+        self._transaction()
+        try:
+            stale = time.time() - STALE_SECONDS
+            self.con.execute("""
+                UPDATE jobs SET status = 'failed', error = coalesce(error, 'worker stopped reporting')
+                WHERE status = 'running' AND heartbeat < ? AND attempts >= ?
+            """, (stale, MAX_ATTEMPTS))
+            row = self.con.execute("""
+                SELECT job_id FROM jobs
+                WHERE status = 'pending' OR (status = 'running' AND heartbeat < ? AND attempts < ?)
+                ORDER BY bytes DESC, job_id
+                LIMIT 1
+            """, (stale, MAX_ATTEMPTS)).fetchone()
+            if row is not None:
+                self.con.execute("""
+                    UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1
+                    WHERE job_id = ?
+                """, (worker, time.time(), row[0]))
+            self.con.execute("COMMIT")
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], self.paths(row[0])
+
+    def paths(self, job_id):
+        return [row[0] for row in self.con.execute(
+            "SELECT path FROM job_files WHERE job_id = ? ORDER BY position", (job_id,))]
+
+    # Each of these returns False when worker no longer holds the job, which another worker
+    # has then claimed after it went stale
+
+    def heartbeat(self, job_id, worker):
+        return self.con.execute("UPDATE jobs SET heartbeat = ? WHERE job_id = ? AND worker = ?",
+                                (time.time(), job_id, worker)).rowcount == 1
+
+    def complete(self, job_id, worker):
+        return self.con.execute("UPDATE jobs SET status = 'done', error = NULL WHERE job_id = ? AND worker = ?",
+                                (job_id, worker)).rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """Put the job back to be retried, or mark it failed after MAX_ATTEMPTS."""
+        return self.con.execute("""
+            UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = ?
+            WHERE job_id = ? AND worker = ?
+        """, (MAX_ATTEMPTS, error, job_id, worker)).rowcount == 1
+
+    def done_jobs(self):
+        return [row[0] for row in self.con.execute("SELECT job_id FROM jobs WHERE status = 'done' ORDER BY job_id")]
+
+    def progress(self):
+        """Number of jobs and of their bytes by status."""
+        return {status: (jobs, job_bytes) for status, jobs, job_bytes in self.con.execute(
+            "SELECT status, COUNT(*), SUM(bytes) FROM jobs GROUP BY status")}
+
+
+def _keep_alive(ledger_path, job_id, worker, stop):
+    # Errors (a lock held past the timeout, say) are logged and retried at the next beat; if
+    # this thread died, the job would go stale and be claimed again while it is still running
+    ledger = None
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            ledger = ledger or JobLedger(ledger_path)
+            if not ledger.heartbeat(job_id, worker):
+                logger.warning(f"Job {job_id} is no longer claimed by {worker}")
+        except Exception as e:
+            logger.warning(f"Heartbeat of job {job_id} failed, retrying: {e}")
+    if ledger is not None:
+        ledger.close()
+
+
+def work(ledger_path, run):
+    """
+    Claim and run jobs from the ledger until none are left; run(job_id, paths) is called for
+    each. Returns the number of jobs this worker finished.
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    ledger = JobLedger(ledger_path)
+    finished = 0
+    while (job := ledger.claim(worker)) is not None:
+        job_id, paths = job
+        stop = threading.Event()
+        keep_alive = threading.Thread(target=_keep_alive, args=(ledger_path, job_id, worker, stop), daemon=True)
+        keep_alive.start()
+        try:
+            run(job_id, paths)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            if not ledger.fail(job_id, worker, repr(e)):
+                logger.warning(f"Job {job_id} was claimed by another worker while {worker} ran it")
+        else:
+            if ledger.complete(job_id, worker):
+                finished += 1
+            else:
+                logger.warning(f"Job {job_id} was claimed by another worker while {worker} ran it; "
+                               f"its results may be written twice")
+        finally:
+            stop.set()
+            keep_alive.join()
+    ledger.close()
+    return finished
+
+
+def run_ledger(ledger_path, run, workers=None, initializer=None, initargs=()):
+    """Work through the ledger with a pool of worker processes; more hosts can run it on the same ledger."""
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        return sum(pool.map(work, [ledger_path] * workers, [run] * workers))
@@ -0,0 +1,112 @@
+import bz2
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import duckdb
+import pandas as pd
+
+MARKET_FILES_FOLDER = 'E:/Data/tennis/betfair-market-files/'
+CATALOG_TABLE = 'betfair_market_catalog'
+
+CATALOG_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+    market_id VARCHAR PRIMARY KEY,
+    path VARCHAR,
+    size BIGINT,
+    mtime DOUBLE,
+    market_time TIMESTAMP,
+    event_type_id VARCHAR,
+    market_type VARCHAR
+)
+"""
+
+
+def scan_market_files(folder):
+    """(market_id, path, size, mtime) of every .bz2 market file under folder."""
+    files = []
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith('.bz2'):
+                    stat = entry.stat()
+                    files.append((entry.name[:-len('.bz2')], entry.path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def read_market_definition(path):
+    """Start time, event type and market type from the first market definition in a stream file."""
+    try:
+        with bz2.open(path, 'rt') as f:
+            for line in f:
+                for market in json.loads(line).get('mc', []):
+                    definition = market.get('marketDefinition')
+                    if definition:
+                        return definition.get('marketTime'), definition.get('eventTypeId'), definition.get('marketType')
+    except (OSError, EOFError, ValueError) as e:
+        print(f"Error reading {path}: {e}")
+    return None, None, None
+
+
+def refresh_catalog(con, folder=MARKET_FILES_FOLDER, workers=None):
+    """
+    Add new or changed market files under folder to the catalog and drop those no longer there.
+
+    A market stored more than once is catalogued at its last path. Each market's file is
+    matched to the catalog by market id, path, size and mtime, so only new or rewritten files
+    are opened to read their market definition. Returns the number of files (re)catalogued.
+    """
+    con.execute(CATALOG_SQL)
+    catalogued = {market_id: (path, size, mtime) for market_id, path, size, mtime in
+                  con.execute(f"SELECT market_id, path, size, mtime FROM {CATALOG_TABLE}").fetchall()}
+    # The copy kept is chosen from every scanned file, so it does not depend on what is catalogued
+    files = {file[0]: file for file in sorted(scan_market_files(folder), key=lambda file: file[1])}
+    changed = [file for market_id, file in files.items() if catalogued.get(market_id) != file[1:]]
+    removed = catalogued.keys() - files.keys()
+
+    with ProcessPoolExecutor(workers) as pool:
+        definitions = list(pool.map(read_market_definition, [file[1] for file in changed], chunksize=64))
+
+    new_files = pd.DataFrame([file + definition for file, definition in zip(changed, definitions)],
+                             columns=['market_id', 'path', 'size', 'mtime', 'market_time', 'event_type_id',
+                                      'market_type'])
+    new_files['market_time'] = pd.to_datetime(new_files['market_time'], utc=True).dt.tz_localize(None)
+
+    con.register('removed_market_ids', pd.DataFrame({'market_id': list(removed)}, dtype=str))
+    con.register('new_market_files', new_files)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {CATALOG_TABLE} WHERE market_id IN (SELECT market_id FROM removed_market_ids)")
+        con.execute(f"INSERT OR REPLACE INTO {CATALOG_TABLE} BY NAME SELECT * FROM new_market_files")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    con.unregister('removed_market_ids')
+    con.unregister('new_market_files')
+    return len(new_files)
+
+
+def market_files(con, market_ids=None):
+    """Paths of the catalogued market files, optionally only of market_ids, ordered by market id."""
+    if market_ids is None:
+        return [row[0] for row in con.execute(f"SELECT path FROM {CATALOG_TABLE} ORDER BY market_id").fetchall()]
+    con.register('wanted_market_ids', pd.DataFrame({'market_id': list(market_ids)}, dtype=str))
+    paths = [row[0] for row in con.execute(f"""
+        SELECT c.path
+        FROM {CATALOG_TABLE} c
+        INNER JOIN wanted_market_ids w ON c.market_id = w.market_id
+        ORDER BY c.market_id
+    """).fetchall()]
+    con.unregister('wanted_market_ids')
+    return paths
+
+
+if __name__ == "__main__":
+    # Run after new market files are added; the recorder and the simulation only read the catalog
+    con = duckdb.connect("E:/duckdb/tennis.duckdb")
+    print(f"{refresh_catalog(con)} market files catalogued")
+    print(f"{con.execute(f'SELECT COUNT(*) FROM {CATALOG_TABLE}').fetchone()[0]} markets in the catalog")
+    con.close()
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from base_table import TENNIS_MARKETS_SQL, table_exists
+from names import NameCache, normalise_names
+
+MATCH_MAPPING_TABLE = 'market_match_mapping'
+WATERMARK_TABLE = 'market_match_mapping_watermark'
+# A market is the event of the same two players starting less than a day either side of it
+MATCH_WINDOW = pd.Timedelta(days=1)
+
+MATCH_MAPPING_SQL = f"""
+CREATE TABLE IF NOT EXISTS {MATCH_MAPPING_TABLE} (
+    id BIGINT,
+    market_id VARCHAR,
+    time_diff INTEGER,
+    mapped_at TIMESTAMP
+)
+"""
+
+MAPPING_EVENTS_SQL = """
+SELECT id, datetime, home_team, away_team, home_team_slug, away_team_slug
+FROM sofascore_events
+WHERE tournament_category IN ('ATP','WTA','Challenger','ITF Men','ITF Women','WTA 125')
+AND match_status != 'Not started'
+"""
+
+
+def player_pair(index_a, index_b):
+    """One int64 per pair of player indices, the same whichever way round they come."""
+    index_a, index_b = np.asarray(index_a, dtype=np.int64), np.asarray(index_b, dtype=np.int64)
+    return (np.minimum(index_a, index_b) << 32) | np.maximum(index_a, index_b)
+
+
+def market_pairs(tennis_markets, excluded_selection_names, name_mapping, name_cache=None):
+    """market_id, event_date and player pair of the markets with both runners' names mapped to a player."""
+    tennis_markets = tennis_markets[~tennis_markets['selection_name'].str.contains('/')]
+    tennis_markets = tennis_markets[~tennis_markets['selection_name'].isin(excluded_selection_names)]
+    runners = tennis_markets[['market_id', 'event_date']].assign(
+        bf_name=normalise_names(tennis_markets['selection_name'], cache=name_cache))
+    runners = runners.merge(name_mapping, left_on='bf_name', right_on='name')
+    runners = runners[runners.groupby('market_id')['index'].transform('size') == 2].sort_values('market_id')
+    index = runners['index'].to_numpy(dtype=np.int64)
+    markets = runners.iloc[::2][['market_id', 'event_date']].reset_index(drop=True)
+    markets['event_date'] = pd.to_datetime(markets['event_date'])
+    markets['pair'] = player_pair(index[::2], index[1::2])
+    return markets
+
+
+def event_pairs(sofascore_events, name_mapping, name_cache=None):
+    """
+    id, datetime and player pair of the events with both players' names mapped. Events whose
+    names map to more than one pair are left out, as they are ambiguous.
+    """
+    sofascore_events = sofascore_events[~sofascore_events['home_team'].str.contains('/')]
+    sofascore_events = sofascore_events[~sofascore_events['away_team'].str.contains('/')]
+    events = pd.DataFrame({
+        'id': sofascore_events['id'].astype(np.int64),
+        'datetime': pd.to_datetime(sofascore_events['datetime']),
+        'home_clean_name': normalise_names(sofascore_events['home_team_slug'], 1, cache=name_cache),
+        'away_clean_name': normalise_names(sofascore_events['away_team_slug'], 1, cache=name_cache),
+    })
+    events = events.merge(name_mapping, left_on='home_clean_name', right_on='name').merge(
+        name_mapping, left_on='away_clean_name', right_on='name', suffixes=('_home', '_away'))
+    events['pair'] = player_pair(events['index_home'], events['index_away'])
+    events = events[['id', 'datetime', 'pair']].drop_duplicates()
+    return events[events.groupby('id')['pair'].transform('nunique') == 1].reset_index(drop=True)
+
+
+class EventIndex:
+    """Events sorted by (player pair, start time), so a pair's events around a time are found by binary search."""
+
+    def __init__(self, events):
+        pairs = events['pair'].to_numpy(dtype=np.int64)
+        times = events['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        order = np.lexsort((times, pairs))
+        self.pairs = pairs[order]
+        self.times = times[order]
+        self.ids = events['id'].to_numpy(dtype=np.int64)[order]
+
+    def lookup(self, pairs, times, window=MATCH_WINDOW):
+        """
+        (position, event id, event start) of each event of pairs[position] starting within window
+        of times[position].
+        """
+        pairs = np.asarray(pairs, dtype=np.int64)
+        times = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+        window = window.value
+        starts = np.searchsorted(self.pairs, pairs, side='left')
+        ends = np.searchsorted(self.pairs, pairs, side='right')
+        positions, rows = [], []
+        for position in np.flatnonzero(ends > starts):
+            start, end = starts[position], ends[position]
+            pair_times = self.times[start:end]
+            first = start + np.searchsorted(pair_times, times[position] - window, side='right')
+            last = start + np.searchsorted(pair_times, times[position] + window, side='left')
+            positions.extend([position] * (last - first))
+            rows.extend(range(first, last))
+        rows = np.array(rows, dtype=np.int64)
+        return np.array(positions, dtype=np.int64), self.ids[rows], self.times[rows].view('datetime64[ns]')
+
+
+def match_markets_to_events(markets, events, window=MATCH_WINDOW):
+    """id, market_id and time_diff (whole days) of each market and the events of its pair within window of it."""
+    positions, ids, starts = EventIndex(events).lookup(markets['pair'], markets['event_date'], window)
+    time_diff = pd.Series(starts - markets['event_date'].to_numpy(dtype='datetime64[ns]')[positions])
+    matched = pd.DataFrame({'id': ids, 'market_id': markets['market_id'].to_numpy()[positions],
+                            'time_diff': time_diff.abs().dt.days.to_numpy(dtype=np.int32)})
+    return matched.drop_duplicates().reset_index(drop=True)
+
+
+def get_watermark(con):
+    if not table_exists(con, WATERMARK_TABLE):
+        return None
+    row = con.execute(f"SELECT max_event_date FROM {WATERMARK_TABLE}").fetchone()
+    return row[0] if row else None
+
+
+def update_match_mapping(con, excluded_selection_names, name_mapping, incremental=True, lookback_days=7,
+                         window=MATCH_WINDOW):
+    """
+    Map Betfair markets to SofaScore events in the market_match_mapping table.
+
+    A full run (the first, or incremental=False) maps every market. After that only markets not
+    yet mapped, starting from lookback_days before the latest market date already processed, are
+    mapped, against just the events within window of them; a market left unmapped because its
+    event was not in yet is tried again on later runs until it falls out of the lookback. Changes
+    to the name mapping need a full run to reach older markets. Rows are stamped with mapped_at,
+    so build_base_table can refresh the markets of events it has already written. Returns the
+    number of rows added.
+    """
+    watermark = get_watermark(con) if incremental and table_exists(con, MATCH_MAPPING_TABLE) else None
+    con.execute(MATCH_MAPPING_SQL)
+    # Tables from before mapped_at was added; their rows keep a NULL mapped_at
+    con.execute(f"ALTER TABLE {MATCH_MAPPING_TABLE} ADD COLUMN IF NOT EXISTS mapped_at TIMESTAMP")
+
+    if watermark is None:
+        tennis_markets = con.execute(TENNIS_MARKETS_SQL).df()
+    else:
+        tennis_markets = con.execute(f"""
+            SELECT * FROM ({TENNIS_MARKETS_SQL}) t
+            WHERE CAST(t.event_date AS TIMESTAMP) > ?::TIMESTAMP - INTERVAL {int(lookback_days)} DAY
+            AND CAST(t.market_id AS VARCHAR) NOT IN (SELECT market_id FROM {MATCH_MAPPING_TABLE})
+        """, [watermark]).df()
+    tennis_markets['market_id'] = tennis_markets['market_id'].astype(str)
+
+    name_cache = NameCache()
+    markets = market_pairs(tennis_markets, excluded_selection_names, name_mapping, name_cache)
+    if markets.empty:
+        name_cache.save()
+        return 0
+    sofascore_events = con.execute(f"""
+        SELECT * FROM ({MAPPING_EVENTS_SQL}) e
+        WHERE CAST(e.datetime AS TIMESTAMP) > ?::TIMESTAMP AND CAST(e.datetime AS TIMESTAMP) < ?::TIMESTAMP
+    """, [(markets['event_date'].min() - window).to_pydatetime(),
+          (markets['event_date'].max() + window).to_pydatetime()]).df()
+    events = event_pairs(sofascore_events, name_mapping, name_cache)
+    name_cache.save()
+
+    matched = match_markets_to_events(markets, events, window)
+    new_watermark = markets['event_date'].max() if watermark is None else max(watermark, markets['event_date'].max())
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if watermark is None:
+            con.execute(f"DELETE FROM {MATCH_MAPPING_TABLE}")
+        con.register('new_market_matches', matched)
+        con.execute(f"""
+            DELETE FROM {MATCH_MAPPING_TABLE}
+            WHERE market_id IN (SELECT market_id FROM new_market_matches)
+        """)
+        con.execute(f"""
+            INSERT INTO {MATCH_MAPPING_TABLE} BY NAME
+            SELECT *, current_timestamp AS mapped_at FROM new_market_matches
+        """)
+        con.unregister('new_market_matches')
+        con.execute(f"CREATE OR REPLACE TABLE {WATERMARK_TABLE} (max_event_date TIMESTAMP, updated_at TIMESTAMP)")
+        con.execute(f"INSERT INTO {WATERMARK_TABLE} VALUES (?, now())", [new_watermark])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    return len(matched)
@@ -0,0 +1,182 @@
+import math
+from collections import Counter
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+NGRAM = 3
+# Pairs sharing only n-grams are scored when they share at least this fraction of a name's n-grams
+MIN_SHARED_FRACTION = 0.5
+# Queries blocked at a time, which bounds the memory of the key joins
+BATCH_SIZE = 5000
+# Score cells per process.cdist call of a full scan (8 bytes each)
+FALLBACK_CELLS = 10_000_000
+
+
+def name_ngrams(name, ngram=NGRAM):
+    padded = f' {name} '
+    return {padded[j:j + ngram] for j in range(len(padded) - ngram + 1)}
+
+
+def name_keys(names, gram_counts, ngram=NGRAM, min_shared_fraction=MIN_SHARED_FRACTION):
+    """
+    Blocking keys of cleaned names, as a (key, id) frame with id the position in names: name
+    tokens, initials, and each name's rarest n-grams by gram_counts. Two names sharing at least
+    min_shared_fraction of the n-grams of the longer one share one of those rarest ones (prefix
+    filtering), so the common n-grams, which would block almost everything, are not joined on.
+    """
+    keys = []
+    for i, name in enumerate(names):
+        words = name.split()
+        if not words:
+            continue
+        keys.extend((f't:{word}', i) for word in set(words) if len(word) > 1)
+        # Initials plus the start of the longest word: 'j smith' and 'john smyth' share i:js:sm
+        keys.append((f"i:{''.join(sorted(word[0] for word in words))}:{max(words, key=len)[:2]}", i))
+        grams = sorted(name_ngrams(name, ngram), key=lambda gram: (gram_counts.get(gram, 0), gram))
+        prefix = len(grams) - math.ceil(min_shared_fraction * len(grams)) + 1
+        keys.extend((f'g:{gram}', i) for gram in grams[:prefix])
+    return pd.DataFrame(keys, columns=['key', 'id'])
+
+
+class NameMatcher:
+    """
+    Fuzzy matches names against a fixed set of candidate names with fuzz.ratio, in rapidfuzz's
+    C batch scorer across threads. By default every name is scored against every candidate,
+    so the matches are exactly those of a full scan.
+
+    With blocked, only candidates that share a name token, initials or enough character
+    n-grams with a name are scored, and names left with no match by that are scored against
+    every candidate. This is lossy: a pair can reach the threshold without sharing any of
+    those keys (several scattered edits, say), so a name with some blocked match can still
+    miss others, and with them a better one for top_k.
+    """
+
+    def __init__(self, choices, ngram=NGRAM, min_shared_fraction=MIN_SHARED_FRACTION):
+        self.choices = pd.Series(choices).dropna().astype(str).drop_duplicates().to_numpy()
+        self.lengths = np.array([len(choice) for choice in self.choices])
+        self.ngram = ngram
+        self.min_shared_fraction = min_shared_fraction
+        self.gram_counts = Counter(gram for choice in self.choices for gram in name_ngrams(choice, ngram))
+        self.keys = name_keys(self.choices, self.gram_counts, ngram, min_shared_fraction)
+
+    def candidate_pairs(self, names):
+        """(query, choice) positions of the blocked candidate pairs of names."""
+        keys = name_keys(names, self.gram_counts, self.ngram, self.min_shared_fraction)
+        pairs = keys.merge(self.keys, on='key', suffixes=('_query', '_choice'))
+        # Pairs sharing several keys come out of the join once per key
+        pairs = pd.unique(pairs['id_query'].to_numpy(np.int64) * len(self.choices) + pairs['id_choice'].to_numpy(np.int64))
+        return np.divmod(pairs, len(self.choices))
+
+    def match(self, names, threshold=80, top_k=5, workers=-1, blocked=False, batch_size=BATCH_SIZE):
+        """
+        For each distinct name, the candidates with fuzz.ratio >= threshold, best first (ties in
+        candidate order), at most top_k of them unless top_k is None. blocked scores only the
+        blocked candidate pairs (see the class docstring). Returns a frame of name, match and
+        similarity in the order the names came in.
+        """
+        names = pd.Series(names).dropna().astype(str).drop_duplicates().to_numpy()
+        if blocked:
+            results = self.match_blocked(names, threshold, workers, batch_size)
+        else:
+            results = [self.match_all(names, np.arange(len(names)), threshold, workers)]
+
+        matches = pd.concat(results)
+        matches = matches.sort_values(['query', 'similarity', 'choice'], ascending=[True, False, True])
+        if top_k is not None:
+            matches = matches.groupby('query').head(top_k)
+        return pd.DataFrame({'name': names[matches['query'].to_numpy(dtype=int)],
+                             'match': self.choices[matches['choice'].to_numpy(dtype=int)],
+                             'similarity': matches['similarity'].to_numpy(dtype=np.float64)})
+
+    def match_blocked(self, names, threshold, workers=-1, batch_size=BATCH_SIZE):
+        """
+        (query, choice, similarity) frames of the blocked pairs of names at or above threshold,
+        then of the names with none of those against every candidate.
+        """
+        query_lengths = np.array([len(name) for name in names])
+        results = []
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            query, choice = self.candidate_pairs(batch)
+            query += start
+            # The ratio can not reach threshold when the lengths alone are too far apart
+            lengths = query_lengths[query] + self.lengths[choice]
+            possible = 200 * np.minimum(query_lengths[query], self.lengths[choice]) >= threshold * lengths
+            query, choice = query[possible], choice[possible]
+            similarity = process.cpdist(names[query], self.choices[choice], scorer=fuzz.ratio,
+                                        score_cutoff=threshold, dtype=np.float64, workers=workers)
+            matched = similarity >= threshold
+            results.append(pd.DataFrame({'query': query[matched], 'choice': choice[matched],
+                                         'similarity': similarity[matched]}))
+
+        matched = np.zeros(len(names), dtype=bool)
+        for result in results:
+            matched[result['query'].to_numpy(dtype=int)] = True
+        results.append(self.match_all(names, np.flatnonzero(~matched), threshold, workers))
+        return results
+
+    def match_all(self, names, queries, threshold, workers=-1):
+        """(query, choice, similarity) of names[queries] at or above threshold against every candidate."""
+        results = [pd.DataFrame({'query': [], 'choice': [], 'similarity': []})]
+        rows = max(1, FALLBACK_CELLS // max(len(self.choices), 1))
+        for start in range(0, len(queries), rows):
+            batch = queries[start:start + rows]
+            scores = process.cdist(names[batch], self.choices, scorer=fuzz.ratio, score_cutoff=threshold,
+                                   dtype=np.float64, workers=workers)
+            query, choice = np.nonzero(scores >= threshold)
+            results.append(pd.DataFrame({'query': batch[query], 'choice': choice,
+                                         'similarity': scores[query, choice]}))
+        return pd.concat(results)
+
+
+def match_via_fixtures(con, matches, name_mapping, markets, events, max_days=1):
+    """
+    For each Betfair name, the mapped SofaScore name whose events line up in date with the most
+    of the name's markets, in one query. Candidates are every name mapped (index, name) to the
+    same player as one of the name's fuzzy matches (name, match, as from NameMatcher.match); a
+    market (bf_name, market_id, datetime) lines up with an event (home_clean_name,
+    away_clean_name, event_date) when the days between them, floored, are within max_days.
+    Returns bf_name, matched_name and matches_count, the number of market and event pairs.
+    """
+    con.register('fuzzy_matches', matches[['name', 'match']])
+    con.register('fixture_mapping', name_mapping[['index', 'name']])
+    con.register('fixture_markets', markets[['bf_name', 'market_id', 'datetime']])
+    con.register('fixture_events', events[['home_clean_name', 'away_clean_name', 'event_date']])
+    df = con.execute(f"""
+    WITH candidates AS (
+        SELECT DISTINCT f.name AS bf_name, a.name AS matched_name
+        FROM fuzzy_matches f
+        INNER JOIN fixture_mapping m ON m.name = f.match
+        INNER JOIN fixture_mapping a ON a.index = m.index
+    ),
+    events AS (
+        SELECT row_number() OVER () AS event_row, * FROM fixture_events
+    ),
+    event_candidates AS (
+        -- An event with both players among a name's candidates counts for the away player
+        SELECT bf_name, event_row, ANY_VALUE(event_date) AS event_date, arg_max(matched_name, away) AS matched_name
+        FROM (
+            SELECT c.bf_name, e.event_row, e.event_date, c.matched_name, false AS away
+            FROM candidates c
+            INNER JOIN events e ON e.home_clean_name = c.matched_name
+            UNION ALL
+            SELECT c.bf_name, e.event_row, e.event_date, c.matched_name, true AS away
+            FROM candidates c
+            INNER JOIN events e ON e.away_clean_name = c.matched_name
+        )
+        GROUP BY bf_name, event_row
+    )
+    SELECT e.bf_name, e.matched_name, COUNT(k.market_id) AS matches_count
+    FROM event_candidates e
+    INNER JOIN fixture_markets k
+    ON k.bf_name = e.bf_name
+        AND floor((epoch_us(k.datetime) - epoch_us(e.event_date)) / 86400000000) BETWEEN -{max_days} AND {max_days}
+    GROUP BY e.bf_name, e.matched_name
+    HAVING COUNT(k.market_id) > 0
+    QUALIFY row_number() OVER (PARTITION BY e.bf_name ORDER BY matches_count DESC, e.matched_name) = 1
+    ORDER BY e.bf_name
+    """).df()
+    for view in ['fuzzy_matches', 'fixture_mapping', 'fixture_markets', 'fixture_events']:
+        con.unregister(view)
+    return df
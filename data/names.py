@@ -0,0 +1,101 @@
+import os
+import re
+import unidecode
+import pandas as pd
+
+# Cleaned names by raw name; the version is in the file name, so a change to clean_name starts a new cache
+NAME_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processing-files', 'clean_names_v1.parquet')
+MAX_REVERSE = 4
+
+NON_LETTERS = re.compile(r'[^a-z\s]')
+
+
+def clean_name(name):
+    """Lower case, ascii letters only and hyphens as spaces, with single spaces between words."""
+    name = unidecode.unidecode(name.lower()).replace('-', ' ')
+    return ' '.join(NON_LETTERS.sub('', name).split())
+
+
+def arrange_name(clean, words_to_reverse=0, slug=False, first_name_initial=None):
+    """
+    A cleaned name with its first words_to_reverse words moved to the end (if it has more words
+    than that), the new first word cut to its initial if first_name_initial, joined by hyphens if slug.
+    """
+    words = clean.split()
+    if 0 < words_to_reverse < len(words):
+        words = words[words_to_reverse:] + words[0:words_to_reverse]
+        if first_name_initial:
+            words[0] = words[0][0]
+    return ('-' if slug else ' ').join(words)
+
+
+def process_name(name, words_to_reverse, slug=True, first_name_initial=None):
+    return arrange_name(clean_name(name), words_to_reverse, slug, first_name_initial)
+
+
+class NameCache:
+    """Cleaned names keyed by raw name, kept in a Parquet file across runs."""
+
+    def __init__(self, path=NAME_CACHE):
+        self.path = path
+        self.names = {}
+        self.added = 0
+        if path and os.path.exists(path):
+            df = pd.read_parquet(path)
+            self.names = dict(zip(df['raw_name'], df['clean_name']))
+
+    def clean(self, names):
+        """clean_name of each distinct name in names, as a dict; names not seen before are cleaned and cached."""
+        new = [name for name in pd.unique(pd.Series(names).dropna()) if name not in self.names]
+        for name in new:
+            self.names[name] = clean_name(name)
+        self.added += len(new)
+        return self.names
+
+    def save(self):
+        """Write the cache if names were added since it was loaded."""
+        if not self.path or not self.added:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        pd.DataFrame({'raw_name': list(self.names), 'clean_name': list(self.names.values())}).to_parquet(
+            self.path + '.tmp', index=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.added = 0
+
+
+def _clean_lookup(names, cache):
+    if cache is not None:
+        return cache.clean(names)
+    return {name: clean_name(name) for name in pd.unique(pd.Series(names).dropna())}
+
+
+def normalise_names(names, words_to_reverse=0, slug=False, first_name_initial=None, cache=None):
+    """process_name over a Series of names, worked out once per distinct name; missing names stay missing."""
+    names = pd.Series(names)
+    clean = _clean_lookup(names, cache)
+    return names.map({name: arrange_name(clean[name], words_to_reverse, slug, first_name_initial)
+                      for name in pd.unique(names.dropna())})
+
+
+def name_variants(names, prefix, max_reverse=MAX_REVERSE, slug=False, cache=None):
+    """
+    Every word-reversal variant of each distinct name in one pass, as a frame indexed by name:
+    prefix holds the cleaned name and, for n in 1..max_reverse, {prefix}_{n}_rev holds it with its
+    first n words moved to the end and {prefix}_{n}_rev_init the same with the new first word cut
+    to its initial (as process_name(name, n, slug, True) does).
+    """
+    unique = pd.unique(pd.Series(names).dropna())
+    clean = _clean_lookup(unique, cache)
+    rows = []
+    for name in unique:
+        words = clean[name].split()
+        variants = [words]
+        for n in range(1, max_reverse + 1):
+            if n < len(words):
+                reversed_words = words[n:] + words[:n]
+                variants += [reversed_words, [reversed_words[0][0]] + reversed_words[1:]]
+            else:
+                variants += [words, words]
+        rows.append([('-' if slug else ' ').join(variant) for variant in variants])
+    columns = [prefix] + [f'{prefix}_{n}_rev{init}' for n in range(1, max_reverse + 1) for init in ['', '_init']]
+    return pd.DataFrame(rows, index=unique, columns=columns)
@@ -0,0 +1,173 @@
+import bz2
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from market_catalog import market_files
+
+# Seconds before the scheduled start at which prices are captured
+HORIZONS = (3600, 600, 300, 60, 1)
+SNAPSHOTS_FILE = 'price_snapshots.parquet'
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('market_id', pa.string()), ('horizon', pa.int32()), ('seconds_to_start', pa.float64()),
+    ('publish_time', pa.timestamp('ms')), ('selection_id', pa.int64()), ('total_matched', pa.float64()),
+    ('atb', pa.float64()), ('atb_size', pa.float64()), ('atl', pa.float64()), ('atl_size', pa.float64()),
+    ('last_traded_price', pa.float64()),
+])
+
+
+def _update_ladder(ladder, levels):
+    # [price, size] pairs; a size of 0 removes the price
+    for price, size in levels:
+        if size == 0:
+            ladder.pop(price, None)
+        else:
+            ladder[price] = size
+
+
+class RunnerLadder:
+    """Available to back/lay and traded volume by price, and the last traded price of one runner."""
+
+    __slots__ = ('back', 'lay', 'traded', 'last_traded_price')
+
+    def __init__(self):
+        self.back = {}
+        self.lay = {}
+        self.traded = {}
+        self.last_traded_price = None
+
+    def update(self, change):
+        if 'ltp' in change:
+            self.last_traded_price = change['ltp']
+        if 'trd' in change:
+            if change['trd']:
+                _update_ladder(self.traded, change['trd'])
+            else:
+                self.traded.clear()
+        if 'atb' in change:
+            _update_ladder(self.back, change['atb'])
+        if 'atl' in change:
+            _update_ladder(self.lay, change['atl'])
+
+    def total_matched(self):
+        # Summed in price order and rounded, as flumine's cumulative_runner_tv does
+        return round(sum(size for _, size in sorted(self.traded.items())), 2)
+
+
+class MarketState:
+    """Just enough of one market's stream to take price snapshots before the start."""
+
+    def __init__(self, horizons, market_types):
+        self.horizons = sorted(horizons, reverse=True)
+        self.market_types = market_types
+        self.market_time = None
+        self.market_type = None
+        self.in_play = False
+        self.status = None
+        self.runners = {}
+
+    @property
+    def done(self):
+        return not self.horizons
+
+    def update(self, change):
+        if change.get('img'):
+            self.runners = {}
+        definition = change.get('marketDefinition')
+        if definition:
+            self.market_time = round(datetime.fromisoformat(definition['marketTime']).timestamp() * 1000)
+            self.market_type = definition.get('marketType')
+            self.in_play = definition.get('inPlay', False)
+            self.status = definition.get('status')
+            for runner in definition.get('runners', []):
+                self.runners.setdefault(runner['id'], RunnerLadder())
+        for runner_change in change.get('rc', []):
+            self.runners.setdefault(runner_change['id'], RunnerLadder()).update(runner_change)
+
+    def snapshot(self, market_id, publish_time, rows):
+        """Append a row per runner for every horizon first reached at publish_time."""
+        if self.market_time is None or self.done:
+            return
+        if self.in_play or self.status == 'CLOSED' or (
+                self.market_types is not None and self.market_type not in self.market_types):
+            self.horizons = []
+            return
+        if self.status != 'OPEN':
+            return
+
+        seconds_to_start = (self.market_time - publish_time) / 1000
+        while self.horizons and seconds_to_start <= self.horizons[0]:
+            horizon = self.horizons.pop(0)
+            for selection_id, runner in self.runners.items():
+                best_back = max(runner.back) if runner.back else None
+                best_lay = min(runner.lay) if runner.lay else None
+                rows['market_id'].append(market_id)
+                rows['horizon'].append(horizon)
+                rows['seconds_to_start'].append(seconds_to_start)
+                rows['publish_time'].append(publish_time)
+                rows['selection_id'].append(selection_id)
+                rows['total_matched'].append(runner.total_matched())
+                rows['atb'].append(best_back)
+                rows['atb_size'].append(runner.back.get(best_back))
+                rows['atl'].append(best_lay)
+                rows['atl_size'].append(runner.lay.get(best_lay))
+                rows['last_traded_price'].append(runner.last_traded_price)
+
+
+def extract_snapshots(path, horizons=HORIZONS, market_types=('MATCH_ODDS',)):
+    """
+    Best back/lay, traded volume and last traded price of every runner at the first update at
+    or after each horizon (seconds before the scheduled start) while the market is open and not
+    in play, read straight from a bz2 stream file.
+
+    Only the ladders are kept, and reading stops once every market in the file is in play or
+    past its last horizon, so the in-play part of the file is never decompressed.
+    """
+    markets = {}
+    rows = {name: [] for name in SNAPSHOT_SCHEMA.names}
+    try:
+        with bz2.open(path, 'rt') as f:
+            for line in f:
+                update = json.loads(line)
+                for change in update.get('mc', []):
+                    market = markets.get(change['id'])
+                    if market is None:
+                        market = markets[change['id']] = MarketState(horizons, market_types)
+                    market.update(change)
+                    market.snapshot(change['id'], update['pt'], rows)
+                if markets and all(market.done for market in markets.values()):
+                    break
+    except (OSError, EOFError, ValueError) as e:
+        print(f"Error reading {path}: {e}")
+    return pa.Table.from_pydict(rows, schema=SNAPSHOT_SCHEMA)
+
+
+def write_snapshots(paths, output_file=SNAPSHOTS_FILE, workers=None, row_group_rows=100_000):
+    """Extract the snapshots of every market file in a process pool into one Parquet file."""
+    pending, pending_rows = [], 0
+    with ProcessPoolExecutor(workers) as pool, pq.ParquetWriter(output_file, SNAPSHOT_SCHEMA) as writer:
+        for table in pool.map(extract_snapshots, paths, chunksize=16):
+            pending.append(table)
+            pending_rows += table.num_rows
+            if pending_rows >= row_group_rows:
+                writer.write_table(pa.concat_tables(pending))
+                pending, pending_rows = [], 0
+        if pending_rows:
+            writer.write_table(pa.concat_tables(pending))
+
+
+if __name__ == "__main__":
+    # Markets in base_table, with their files from the market catalog
+    con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
+    market_ids = set(con.execute("SELECT DISTINCT(market_id) FROM base_table WHERE market_id IS NOT NULL").df()[
+                         'market_id'].tolist())
+    data_files = market_files(con, market_ids)
+    con.close()
+
+    write_snapshots(data_files, workers=os.cpu_count() - 1)
+    print(f"{pq.read_metadata(SNAPSHOTS_FILE).num_rows} snapshot rows written to {SNAPSHOTS_FILE}")
@@ -0,0 +1,185 @@
+import numpy as np
+
+SCORE_STATE_TABLE = 'score_state_history'
+
+# A score state from one player's side; win rates are pooled over everyone who was in it
+STATE_COLUMNS = ['mens', 'bo5', 'sets_for', 'sets_against', 'games_for', 'games_against', 'points_for',
+                 'points_against', 'serving']
+STATES = ', '.join(STATE_COLUMNS)
+
+PLAYER_COLUMNS = ['id', 'position', 'index', 'tournament_points', 'tournament_category', 'datetime']
+
+SCORE_STATE_HISTORY_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SCORE_STATE_TABLE} (
+    mens BOOLEAN,
+    bo5 BOOLEAN,
+    sets_for BIGINT,
+    sets_against BIGINT,
+    games_for BIGINT,
+    games_against BIGINT,
+    points_for VARCHAR,
+    points_against VARCHAR,
+    serving BIGINT,
+    datetime TIMESTAMP,
+    wins BIGINT,
+    points BIGINT,
+    cum_wins BIGINT,
+    cum_points BIGINT
+)
+"""
+
+POINT_STATES_SQL = """
+SELECT
+    p.match_id AS id,
+    e.index,
+    e.datetime,
+    CASE
+        WHEN e.tournament_category IN ('ATP', 'Challenger', 'ITF Men') THEN TRUE
+        ELSE FALSE
+    END AS mens,
+    CASE
+        WHEN e.tournament_category = 'ATP' AND e.tournament_points = 2000.0 THEN TRUE
+        ELSE FALSE
+    END AS bo5,
+    p.sets_for,
+    p.sets_against,
+    p.games_for,
+    p.games_against,
+    p.points_for,
+    p.points_against,
+    p.serving,
+    p.match_winner
+FROM
+    sofascore_point_by_point_clean p
+INNER JOIN
+    state_players e
+ON
+    p.match_id = e.id AND p.position = e.position
+"""
+
+
+def _states(alias):
+    return ', '.join(f'{alias}.{col}' for col in STATE_COLUMNS)
+
+
+def _state_match(left, right):
+    return ' AND '.join(f'{left}.{col} = {right}.{col}' for col in STATE_COLUMNS)
+
+
+def update_score_states(con, players):
+    """
+    Add the points of the matches in players to the score-state history.
+
+    The history holds, per state and match time, the points played in that state and how many
+    of them were by the eventual match winner, with running totals over time. Appending later
+    matches only writes their own rows; matches older than the latest row of a state also
+    rewrite that state's rows from their time on. Each match must be added once.
+    """
+    con.execute(SCORE_STATE_HISTORY_SQL)
+    con.register('state_players', players[PLAYER_COLUMNS])
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE new_state_counts AS
+    SELECT {STATES}, datetime, SUM(match_winner) AS wins, COUNT(match_winner) AS points
+    FROM ({POINT_STATES_SQL})
+    GROUP BY ALL
+    """)
+    con.unregister('state_players')
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE state_since AS
+    SELECT {STATES}, MIN(datetime) AS since
+    FROM new_state_counts
+    GROUP BY ALL
+    """)
+
+    # Rows from each state's earliest new time onwards, merged with the new counts and re-totalled
+    # from the last running totals before it
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE rewritten_states AS
+    WITH counts AS (
+        SELECT {STATES}, datetime, SUM(wins) AS wins, SUM(points) AS points
+        FROM (
+            SELECT {_states('h')}, h.datetime, h.wins, h.points
+            FROM {SCORE_STATE_TABLE} h
+            INNER JOIN state_since s ON {_state_match('h', 's')} AND h.datetime >= s.since
+            UNION ALL
+            SELECT * FROM new_state_counts
+        )
+        GROUP BY ALL
+    ),
+    base AS (
+        SELECT
+            {_states('s')},
+            COALESCE(arg_max(h.cum_wins, h.datetime), 0) AS base_wins,
+            COALESCE(arg_max(h.cum_points, h.datetime), 0) AS base_points
+        FROM state_since s
+        LEFT JOIN {SCORE_STATE_TABLE} h ON {_state_match('h', 's')} AND h.datetime < s.since
+        GROUP BY ALL
+    )
+    SELECT
+        c.*,
+        b.base_wins + SUM(c.wins) OVER w AS cum_wins,
+        b.base_points + SUM(c.points) OVER w AS cum_points
+    FROM counts c
+    INNER JOIN base b ON {_state_match('c', 'b')}
+    WINDOW w AS (PARTITION BY {_states('c')} ORDER BY c.datetime)
+    """)
+    con.execute(f"""
+    DELETE FROM {SCORE_STATE_TABLE} h
+    USING state_since s
+    WHERE {_state_match('h', 's')} AND h.datetime >= s.since
+    """)
+    con.execute(f"INSERT INTO {SCORE_STATE_TABLE} BY NAME SELECT * FROM rewritten_states")
+    for table in ['new_state_counts', 'state_since', 'rewritten_states']:
+        con.execute(f"DROP TABLE {table}")
+
+
+def winrates_as_of(con, states):
+    """
+    Win rate from each score state in states (STATE_COLUMNS plus datetime), counting only
+    matches played strictly before that datetime. Adds wins, points and winrate columns;
+    winrate is NaN for a state with no earlier points.
+    """
+    states = states.assign(state_row=np.arange(len(states)))
+    con.register('as_of_states', states)
+    df = con.execute(f"""
+    SELECT
+        s.*,
+        COALESCE(h.cum_wins, 0) AS wins,
+        COALESCE(h.cum_points, 0) AS points,
+        h.cum_wins / NULLIF(h.cum_points, 0) AS winrate
+    FROM as_of_states s
+    ASOF LEFT JOIN {SCORE_STATE_TABLE} h
+    ON {_state_match('s', 'h')} AND s.datetime > h.datetime
+    ORDER BY s.state_row
+    """).df()
+    con.unregister('as_of_states')
+    return df.drop(columns='state_row').set_index(states.index)
+
+
+def winrate_summary(con, players):
+    """
+    Mean, min, max and std over each player's points in a match of the win rate from the
+    score state before the point, as of the match's start.
+    """
+    con.register('state_players', players[PLAYER_COLUMNS])
+    df_summ = con.execute(f"""
+    WITH point_states AS ({POINT_STATES_SQL}),
+    winrates AS (
+        SELECT p.id, p.index, h.cum_wins / NULLIF(h.cum_points, 0) AS winrate_from_position
+        FROM point_states p
+        ASOF LEFT JOIN {SCORE_STATE_TABLE} h
+        ON {_state_match('p', 'h')} AND p.datetime > h.datetime
+    )
+    SELECT
+        id,
+        index,
+        AVG(winrate_from_position) AS winrate_mean,
+        MIN(winrate_from_position) AS winrate_min,
+        MAX(winrate_from_position) AS winrate_max,
+        STDDEV(winrate_from_position) AS winrate_std
+    FROM winrates
+    GROUP BY id, index
+    ORDER BY id
+    """).df()
+    con.unregister('state_players')
+    return df_summ
@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import json
+import os
+import random
+import time
+import aiohttp
+
+BASE_URL = 'https://api.sofascore.com/api/v1'
+DATA_FOLDER = os.path.join('E:/', 'Data', 'tennis', 'sofascore')
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+    'Referer': 'https://www.sofascore.com/'
+}
+
+
+class Endpoint:
+    """A SofaScore API resource fetched once per key (a date or an event id)."""
+
+    def __init__(self, name, path, folder, filename):
+        self.name = name
+        self.path = path
+        self.folder = folder
+        self.filename = filename
+
+    def url(self, base_url, key):
+        return base_url + self.path.format(key=key)
+
+    def savepath(self, key):
+        return os.path.join(DATA_FOLDER, self.folder, self.filename.format(key=key))
+
+
+ENDPOINTS = {
+    'events-by-day': Endpoint('events-by-day', '/sport/tennis/scheduled-events/{key}', 'events', 'tennis_events_{key}.json'),
+    'statistics': Endpoint('statistics', '/event/{key}/statistics', 'match-stats', 'match_stat_{key}.json'),
+    'point-by-point': Endpoint('point-by-point', '/event/{key}/point-by-point', 'point-by-point', 'pbp_{key}.json'),
+}
+
+
+def save_json(endpoint, key, data):
+    # One indented file per response, as the downloads were originally kept
+    with open(endpoint.savepath(key), 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SofaScoreClient:
+    """
+    One pooled HTTP session shared by a fixed number of workers pulling keys from a single
+    queue, so a slow key only holds up its own worker.
+
+    Requests go through a token bucket. A 429, 5xx or network error halves the rate, pauses
+    every worker (for Retry-After if given, else an exponential backoff) and puts the key
+    back on the queue; each success nudges the rate back up towards max_rate.
+    """
+
+    def __init__(self, concurrency=16, max_rate=10, min_rate=0.5, max_retries=3, backoff=5,
+                 timeout=30, base_url=BASE_URL):
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.base_url = base_url
+        self.bucket = TokenBucket(max_rate)
+        self.paused_until = 0.0
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _throttled(self, attempt, retry_after=None):
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        delay = retry_after if retry_after is not None else self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def _succeeded(self):
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.1 * self.max_rate)
+
+    async def get(self, url, attempt=0):
+        """Returns (status, json or None); status is None on a network error."""
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.bucket.acquire()
+
+        try:
+            async with self.session.get(url) as response:
+                if response.status == 200:
+                    self._succeeded()
+                    return response.status, await response.json(content_type=None)
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get('Retry-After')
+                    self._throttled(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                return response.status, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error downloading {url}: {e!r}")
+            self._throttled(attempt)
+            return None, None
+
+    async def _worker(self, endpoint, queue, save, results):
+        while True:
+            key, attempt = await queue.get()
+            try:
+                status, data = await self.get(endpoint.url(self.base_url, key), attempt)
+                if status == 200:
+                    save(key, data)
+                    results['saved'] += 1
+                elif (status is None or status == 429 or status >= 500) and attempt + 1 < self.max_retries:
+                    queue.put_nowait((key, attempt + 1))
+                    results['retried'] += 1
+                else:
+                    print(f"Failed to get {endpoint.name} for {key}. Status code: {status}")
+                    results['failed'] += 1
+            except Exception as e:
+                print(f"Failed to save {endpoint.name} for {key}: {str(e)}")
+                results['failed'] += 1
+            finally:
+                queue.task_done()
+
+    async def download(self, endpoint, keys, save=None):
+        """Fetches endpoint for every key and hands each response to save(key, data)."""
+        if save is None:
+            save = functools.partial(save_json, endpoint)
+        queue = asyncio.Queue()
+        for key in keys:
+            queue.put_nowait((key, 0))
+
+        results = {'saved': 0, 'retried': 0, 'failed': 0}
+        workers = [asyncio.create_task(self._worker(endpoint, queue, save, results))
+                   for _ in range(self.concurrency)]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return results
+
+
+def download(endpoint, keys, save=None, **client_args):
+    """Blocking entry point for the download scripts."""
+    async def run():
+        async with SofaScoreClient(**client_args) as client:
+            return await client.download(endpoint, keys, save)
+
+    results = asyncio.run(run())
+    print(f"{endpoint.name}: {results['saved']} saved, {results['failed']} failed, {results['retried']} retries")
+    return results
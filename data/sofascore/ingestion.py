@@ -0,0 +1,264 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pyarrow as pa
+
+from point_by_point import mark_stale
+from store import RawStore, STORE_FOLDER, read_frame
+
+# Event fields kept from the events-by-day responses, and the column each is stored as
+EVENT_FIELDS = {
+    'id': ('id', pa.int64()),
+    'slug': ('slug', pa.string()),
+    'groundType': ('groundType', pa.string()),
+    'tournament.uniqueTournament.name': ('tournament_name', pa.string()),
+    'tournament.category.name': ('tournament_category', pa.string()),
+    'tournament.uniqueTournament.tennisPoints': ('tournament_points', pa.float64()),
+    'tournament.uniqueTournament.hasEventPlayerStatistics': ('tournament_has_stats', pa.bool_()),
+    'season.name': ('season_name', pa.string()),
+    'season.year': ('season_year', pa.string()),
+    'roundInfo.name': ('tournament_round', pa.string()),
+    'status.description': ('match_status', pa.string()),
+    'homeTeam.name': ('home_team', pa.string()),
+    'homeTeam.slug': ('home_team_slug', pa.string()),
+    'homeTeam.shortName': ('home_team_short', pa.string()),
+    # Never renamed in the original events table, so kept as is
+    'homeTeam.country.name': ('homeTeam.country.name', pa.string()),
+    'awayTeam.name': ('away_team', pa.string()),
+    'awayTeam.slug': ('away_team_slug', pa.string()),
+    'awayTeam.shortName': ('away_team_short', pa.string()),
+    'awayTeam.country.name': ('away_team_country', pa.string()),
+    'winnerCode': ('winnerCode', pa.float64()),
+    **{f'{side}Score.period{i}': (f'{side}_score_period{i}', pa.float64())
+       for side in ['home', 'away'] for i in range(1, 6)},
+}
+
+EVENTS_SCHEMA = pa.schema(
+    [(name, dtype) for name, dtype in EVENT_FIELDS.values()] +
+    [('event_fetch_date', pa.string()), ('datetime', pa.timestamp('us'))]
+)
+
+MATCH_STATS_SCHEMA = pa.schema([
+    ('match_id', pa.string()), ('period', pa.string()), ('group', pa.string()), ('name', pa.string()),
+    ('home', pa.string()), ('away', pa.string()), ('compareCode', pa.int64()), ('statisticsType', pa.string()),
+    ('valueType', pa.string()), ('homeValue', pa.float64()), ('awayValue', pa.float64()), ('key', pa.string()),
+    ('homeTotal', pa.float64()), ('awayTotal', pa.float64()),
+])
+
+POINT_BY_POINT_SCHEMA = pa.schema([
+    ('match_id', pa.string()), ('set', pa.int64()), ('game', pa.int64()), ('homePoint', pa.string()),
+    ('awayPoint', pa.string()), ('pointDescription', pa.int64()), ('homePointType', pa.int64()),
+    ('awayPointType', pa.int64()), ('serving', pa.float64()), ('scoring', pa.float64()),
+])
+
+MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS sofascore_ingest_manifest (
+    source VARCHAR,
+    shard INTEGER,
+    frame_offset BIGINT,
+    frame_length BIGINT,
+    ingested_at TIMESTAMP
+)
+"""
+
+
+def _get(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+def flatten_events(key, data):
+    rows = []
+    for event in data.get('events', []):
+        row = {}
+        for path, (name, dtype) in EVENT_FIELDS.items():
+            value = _get(event, path)
+            row[name] = _str(value) if dtype == pa.string() else value
+        row['event_fetch_date'] = key
+        start = event.get('startTimestamp')
+        row['datetime'] = None if start is None else datetime.fromtimestamp(start)
+        rows.append(row)
+    return rows
+
+
+def flatten_match_stats(match_id, data):
+    rows = []
+    for period in data.get('statistics', []):
+        for group in period.get('groups', []):
+            for item in group.get('statisticsItems', []):
+                rows.append({
+                    'match_id': match_id,
+                    'period': period.get('period'),
+                    'group': group.get('groupName'),
+                    'name': item.get('name'),
+                    'home': _str(item.get('home')),
+                    'away': _str(item.get('away')),
+                    'compareCode': item.get('compareCode'),
+                    'statisticsType': item.get('statisticsType'),
+                    'valueType': item.get('valueType'),
+                    'homeValue': item.get('homeValue'),
+                    'awayValue': item.get('awayValue'),
+                    'key': item.get('key'),
+                    'homeTotal': item.get('homeTotal'),
+                    'awayTotal': item.get('awayTotal'),
+                })
+    return rows
+
+
+def flatten_point_by_point(match_id, data):
+    rows = []
+    for set_data in data.get('pointByPoint') or []:
+        for game in set_data.get('games', []):
+            for point in game.get('points', []):
+                rows.append({
+                    'match_id': match_id,
+                    'set': set_data.get('set'),
+                    'game': game.get('game'),
+                    'homePoint': _str(point.get('homePoint')),
+                    'awayPoint': _str(point.get('awayPoint')),
+                    'pointDescription': point.get('pointDescription'),
+                    'homePointType': point.get('homePointType'),
+                    'awayPointType': point.get('awayPointType'),
+                })
+
+            # Add a row for the game score if it exists, with -1 marking it as one
+            score = game.get('score')
+            if score:
+                rows.append({
+                    'match_id': match_id,
+                    'set': set_data.get('set'),
+                    'game': game.get('game'),
+                    'homePoint': 'GAME',
+                    'awayPoint': 'GAME',
+                    'pointDescription': -1,
+                    'homePointType': score.get('homeScore'),
+                    'awayPointType': score.get('awayScore'),
+                    'serving': score.get('serving'),
+                    'scoring': score.get('scoring'),
+                })
+    return rows
+
+
+class Source:
+    """
+    A store folder, how its responses flatten to rows, and the table rows are upserted into.
+    on_replace(con, keys), if set, is called in the same transaction as each upsert, for
+    tables derived from this one.
+    """
+
+    def __init__(self, folder, flatten, schema, table, key_col, on_replace=None):
+        self.folder = folder
+        self.flatten = flatten
+        self.schema = schema
+        self.table = table
+        self.key_col = key_col
+        self.on_replace = on_replace
+
+
+SOURCES = {
+    # Every fetch of a day is kept; sofascore_events is rebuilt from them after ingestion
+    'events': Source('events', flatten_events, EVENTS_SCHEMA, 'sofascore_events_raw', 'event_fetch_date'),
+    'match-stats': Source('match-stats', flatten_match_stats, MATCH_STATS_SCHEMA, 'sofascore_match_stats', 'match_id'),
+    # A re-ingested match is cleaned again by the next clean_point_by_point
+    'point-by-point': Source('point-by-point', flatten_point_by_point, POINT_BY_POINT_SCHEMA,
+                             'sofascore_point_by_point', 'match_id', on_replace=mark_stale),
+}
+
+
+def parse_frame(source_name, path, offset, length, positions):
+    """
+    Flatten the indexed responses of one store frame into an Arrow record batch (runs in a
+    worker). Returns the frame's keys too, as a response may flatten to no rows.
+    """
+    source = SOURCES[source_name]
+    lines = read_frame(path, offset, length)
+    keys, rows = [], []
+    for position in positions:
+        record = json.loads(lines[position])
+        keys.append(record['key'])
+        try:
+            rows.extend(source.flatten(record['key'], record['data']))
+        except Exception as e:
+            print(f"Error processing {source_name} {record['key']}: {str(e)}")
+    return keys, pa.RecordBatch.from_pylist(rows, schema=source.schema)
+
+
+def write_batch(con, source, keys, batch):
+    """Replace the rows of keys in the source table, creating the table from the first batch."""
+    con.register('ingest_batch', batch)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {source.table} AS SELECT * FROM ingest_batch LIMIT 0")
+    con.execute(f"DELETE FROM {source.table} WHERE {source.key_col} IN (SELECT unnest(?::VARCHAR[]))", [keys])
+    con.execute(f"INSERT INTO {source.table} BY NAME SELECT * FROM ingest_batch")
+    con.unregister('ingest_batch')
+
+
+def commit_frame(con, source_name, frame, future):
+    source = SOURCES[source_name]
+    con.execute("BEGIN TRANSACTION")
+    try:
+        keys, batch = future.result()
+        write_batch(con, source, keys, batch)
+        if source.on_replace:
+            source.on_replace(con, keys)
+        con.execute("INSERT INTO sofascore_ingest_manifest VALUES (?, ?, ?, ?, current_timestamp)",
+                    [source_name, *frame])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+def rebuild_events(con):
+    """One row per event with the latest non-null value of each column, as groupby('id').last() did."""
+    columns = [name for name in EVENTS_SCHEMA.names if name != 'id']
+    select = ',\n    '.join(f'arg_max("{name}", event_fetch_date) AS "{name}"' for name in columns)
+    con.execute(f"""
+    CREATE OR REPLACE TABLE sofascore_events AS
+    SELECT
+        id,
+        {select}
+    FROM sofascore_events_raw
+    GROUP BY id
+    """)
+
+
+def ingest(con, source_name, store_folder=STORE_FOLDER, workers=None, in_flight=None):
+    """
+    Stream every store frame of a source not yet in the manifest into DuckDB.
+
+    Frames are parsed into Arrow batches in a process pool; at most in_flight of them are
+    pending at once, so memory is bounded by batch size rather than by history. Each frame's
+    upsert and manifest entry are committed together.
+    """
+    source = SOURCES[source_name]
+    store = RawStore(os.path.join(store_folder, source.folder))
+    con.execute(MANIFEST_SQL)
+    done = set(con.execute(
+        "SELECT shard, frame_offset FROM sofascore_ingest_manifest WHERE source = ?", [source_name]
+    ).fetchall())
+    frames = [(frame, positions) for frame, positions in store.frames().items() if frame[:2] not in done]
+    print(f"{source_name}: {len(frames)} new frames to ingest")
+
+    workers = workers or os.cpu_count()
+    in_flight = in_flight or 2 * workers
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for (shard, offset, length), positions in frames:
+            future = pool.submit(parse_frame, source_name, store.shard_path(shard), offset, length, positions)
+            pending.append(((shard, offset, length), future))
+            if len(pending) >= in_flight:
+                commit_frame(con, source_name, *pending.popleft())
+        while pending:
+            commit_frame(con, source_name, *pending.popleft())
+
+    if source_name == 'events' and frames:
+        rebuild_events(con)
@@ -0,0 +1,300 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+CLEAN_TABLE = 'sofascore_point_by_point_clean'
+CLEANED_TABLE = 'sofascore_point_by_point_cleaned'
+
+# Scores only possible in a tiebreak; seen as the previous point outside game 13 they mark a bad match
+INVALID_POINTS_NON_TB = [str(point) for point in [*range(1, 15), *range(16, 24), 41]]
+
+CLEAN_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CLEAN_TABLE} (
+    match_id VARCHAR,
+    "set" BIGINT,
+    game BIGINT,
+    sets_for BIGINT,
+    sets_against BIGINT,
+    games_for BIGINT,
+    games_against BIGINT,
+    points_for VARCHAR,
+    points_against VARCHAR,
+    serving BIGINT,
+    point_winner BIGINT,
+    match_winner BIGINT,
+    position VARCHAR
+)
+"""
+
+CLEANED_MATCHES_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CLEANED_TABLE} (
+    match_id VARCHAR,
+    cleaned_at TIMESTAMP
+)
+"""
+
+# Matches with raw points and no cleaned marker, and matches whose raw points were removed since
+# they were cleaned (their clean rows are left without a marker), so those rows get deleted
+NEW_MATCHES_SQL = f"""
+SELECT DISTINCT p.match_id
+FROM sofascore_point_by_point p
+INNER JOIN sofascore_events e ON p.match_id = e.id
+WHERE p.match_id NOT IN (SELECT match_id FROM {CLEANED_TABLE})
+UNION
+SELECT DISTINCT match_id
+FROM {CLEAN_TABLE}
+WHERE match_id NOT IN (SELECT match_id FROM {CLEANED_TABLE})
+ORDER BY match_id
+"""
+
+CHUNK_SQL = """
+SELECT p.*, e.winnerCode, e.tournament_category, e.tournament_points
+FROM sofascore_point_by_point p
+INNER JOIN pbp_chunk c ON p.match_id = c.match_id
+INNER JOIN sofascore_events e ON p.match_id = e.id
+ORDER BY p.rowid
+"""
+
+
+def _starts(n, *keys):
+    """True on the first row of every run of equal keys."""
+    start = np.ones(n, dtype=bool)
+    if n:
+        start[1:] = False
+        for key in keys:
+            start[1:] |= key[1:] != key[:-1]
+    return start
+
+
+def _shift(values, start, fill):
+    """values moved down one row within runs, with fill on the first row of each run."""
+    shifted = np.empty_like(values)
+    shifted[1:] = values[:-1]
+    shifted[start] = fill
+    return shifted
+
+
+def clean_pbp_data(pbp):
+    """
+    One row per point and side with the score before it (sets, games, points), who served,
+    who won the point and who won the match.
+
+    Point scores are factorized into small integer codes, so the 'A'/'40'/'GAME' tests and the
+    numeric comparisons are lookups into per-score arrays, and the previous point/game/set are
+    shifts of those codes within runs of the sorted keys instead of groupby shifts.
+    """
+    pbp = pbp.sort_values(['match_id', 'set', 'game'])
+    n = len(pbp)
+    match = pd.factorize(pbp['match_id'])[0]
+    game_start = _starts(n, match, pbp['set'].to_numpy(), pbp['game'].to_numpy())
+
+    # Codes for home and away points; '0' (the fill for the first point of a game) and a missing
+    # score are appended, the latter last so that code -1 looks it up
+    codes, labels = pd.factorize(pd.concat([pbp['homePoint'], pbp['awayPoint']], ignore_index=True))
+    zero = len(labels)
+    labels = np.append(np.asarray(labels, dtype=object), ['0', None])
+    number = pd.to_numeric(pd.Series(labels), errors='coerce').to_numpy(dtype=float)
+    is_a, is_40, is_game = labels == 'A', labels == '40', labels == 'GAME'
+    invalid_non_tb = pd.Series(labels).isin(INVALID_POINTS_NON_TB).to_numpy()
+
+    home, away = codes[:n], codes[n:]
+    home_prev = _shift(home, game_start, zero)
+    away_prev = _shift(away, game_start, zero)
+    home_prev[home_prev == -1] = zero
+    away_prev[away_prev == -1] = zero
+
+    home_point_winner = (
+            (number[home] > number[home_prev]) |
+            (is_a[home] & is_40[home_prev]) |
+            (is_a[away_prev] & is_40[away]) |
+            (is_game[home] & (is_a[home_prev] | (is_40[home_prev] & ~is_a[away_prev])))
+    )
+
+    # Games and sets won before each game, from the score rows (pointDescription -1)
+    game_scores = pbp.loc[pbp['pointDescription'].to_numpy() == -1,
+                          ['match_id', 'set', 'game', 'homePointType', 'awayPointType', 'serving']].drop_duplicates()
+    home_games_end = game_scores['homePointType'].to_numpy(dtype=float)
+    away_games_end = game_scores['awayPointType'].to_numpy(dtype=float)
+    score_match = pd.factorize(game_scores['match_id'])[0]
+    set_start = _starts(len(game_scores), score_match, game_scores['set'].to_numpy())
+    match_start = _starts(len(game_scores), score_match)
+
+    def games_before(games_end):
+        return np.nan_to_num(_shift(games_end, set_start, 0), nan=0)
+
+    def sets_before(games_for, games_against):
+        won = (
+                (games_for == 6) & (games_against <= 4) |
+                (games_for == 7) & np.isin(games_against, [5, 6]) |
+                (games_for > 7) & ((games_for - games_against) == 2)
+        )
+        # Sets won in earlier sets of the match: an exclusive cumsum restarted at each match
+        won_before = np.cumsum(won) - won
+        return (won_before - np.maximum.accumulate(np.where(match_start, won_before, 0))).astype(float)
+
+    game_scores = pd.DataFrame({
+        'match_id': game_scores['match_id'].to_numpy(),
+        'set': game_scores['set'].to_numpy(),
+        'game': game_scores['game'].to_numpy(),
+        'homeGames': games_before(home_games_end),
+        'awayGames': games_before(away_games_end),
+        'homeSets': sets_before(home_games_end, away_games_end),
+        'awaySets': sets_before(away_games_end, home_games_end),
+        'homeServing': game_scores['serving'].to_numpy() == 1.0,
+    })
+
+    # pandas' inner merge keeps the points' order and repeats points whose game has several score rows
+    points = pd.DataFrame({
+        'match_id': pbp['match_id'].to_numpy(),
+        'set': pbp['set'].to_numpy(),
+        'game': pbp['game'].to_numpy(),
+        'home': home,
+        'away': away,
+        'home_prev': home_prev,
+        'away_prev': away_prev,
+        'homePointWinner': home_point_winner,
+        'homeMatchWinner': pbp['winnerCode'].to_numpy() == 1.0,
+        'bo5': pbp['bo5'].to_numpy(dtype=bool),
+    })
+    merged = points.merge(game_scores, on=['match_id', 'set', 'game'])
+
+    match = pd.factorize(merged['match_id'])[0]
+    set_, game = merged['set'].to_numpy(), merged['game'].to_numpy()
+    home, away = merged['home'].to_numpy(), merged['away'].to_numpy()
+    home_prev, away_prev = merged['home_prev'].to_numpy(), merged['away_prev'].to_numpy()
+    home_games, away_games = merged['homeGames'].to_numpy(), merged['awayGames'].to_numpy()
+    home_sets, away_sets = merged['homeSets'].to_numpy(), merged['awaySets'].to_numpy()
+
+    invalid = (
+            (~merged['bo5'].to_numpy() & ((home_sets >= 2) | (away_sets >= 2))) |
+            (game != home_games + away_games + 1) |
+            (set_ != home_sets + away_sets + 1) |
+            ((game != 13) & invalid_non_tb[home_prev])
+    )
+    invalid_match = np.zeros(match.max() + 2 if len(match) else 1, dtype=bool)
+    invalid_match[match[invalid]] = True
+
+    next_home_is_game = np.zeros(len(merged), dtype=bool)
+    next_home_is_game[:-1] = is_game[home[1:]] & (match[1:] == match[:-1])
+
+    # As in the original cleaning, `& (a - b) >= 2` binds as `(... & (a - b)) >= 2` and is never
+    # true, so only 7-0 to 7-5 counts as a won tiebreak
+    def win_tiebreak(points_for, points_against):
+        return (number[points_for] == 7.0) & (number[points_against] <= 5.0)
+
+    keep = ~(
+            ((game == 13) & next_home_is_game) |
+            win_tiebreak(home, away) | win_tiebreak(away, home) |
+            win_tiebreak(home_prev, away_prev) | win_tiebreak(away_prev, home_prev) |
+            (is_game[home] & (game == 13)) |
+            invalid_match[match]
+    )
+
+    kept = merged[keep]
+    home_serving = kept['homeServing'].astype(int)
+    point_winner = kept['homePointWinner'].astype(int)
+    match_winner = kept['homeMatchWinner'].astype(int)
+    home_points, away_points = labels[home_prev[keep]], labels[away_prev[keep]]
+
+    def side(sets_for, sets_against, games_for, games_against, points_for, points_against, position):
+        return pd.DataFrame({
+            'match_id': kept['match_id'],
+            'set': kept['set'],
+            'game': kept['game'],
+            'sets_for': kept[sets_for].astype(int),
+            'sets_against': kept[sets_against].astype(int),
+            'games_for': kept[games_for].astype(int),
+            'games_against': kept[games_against].astype(int),
+            'points_for': points_for,
+            'points_against': points_against,
+            'serving': home_serving if position == 'home' else (home_serving != 1).astype(int),
+            'point_winner': point_winner if position == 'home' else (point_winner != 1).astype(int),
+            'match_winner': match_winner if position == 'home' else (match_winner != 1).astype(int),
+            'position': position,
+        }, index=kept.index)
+
+    return pd.concat([
+        side('homeSets', 'awaySets', 'homeGames', 'awayGames', home_points, away_points, 'home'),
+        side('awaySets', 'homeSets', 'awayGames', 'homeGames', away_points, home_points, 'away'),
+    ])
+
+
+def clean_chunk(pbp):
+    # Runs in a worker
+    pbp['bo5'] = (pbp['tournament_category'] == "ATP") & (pbp['tournament_points'] == 2000.0)
+    return clean_pbp_data(pbp)
+
+
+def load_chunk(con, match_ids):
+    """Raw points of match_ids with their event's result, in ingestion order."""
+    con.register('pbp_chunk', pd.DataFrame({'match_id': match_ids}))
+    pbp = con.execute(CHUNK_SQL).df()
+    con.unregister('pbp_chunk')
+    return pbp
+
+
+def write_chunk(con, match_ids, future):
+    """Replace the clean rows of match_ids and mark them cleaned, in one transaction."""
+    pbp_clean = future.result()
+    con.register('pbp_chunk', pd.DataFrame({'match_id': match_ids}))
+    con.register('pbp_clean', pbp_clean)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        # Deleted even when nothing is inserted, so a match that now cleans to no rows loses its old ones
+        con.execute(f"DELETE FROM {CLEAN_TABLE} WHERE match_id IN (SELECT match_id FROM pbp_chunk)")
+        if len(pbp_clean):
+            con.execute(f"INSERT INTO {CLEAN_TABLE} BY NAME SELECT * FROM pbp_clean")
+        con.execute(f"DELETE FROM {CLEANED_TABLE} WHERE match_id IN (SELECT match_id FROM pbp_chunk)")
+        con.execute(f"INSERT INTO {CLEANED_TABLE} SELECT match_id, current_timestamp FROM pbp_chunk")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    con.unregister('pbp_clean')
+    con.unregister('pbp_chunk')
+
+
+def mark_stale(con, match_ids):
+    """
+    Drop the cleaned markers of match_ids, whose raw points are being replaced, so the next
+    clean_point_by_point cleans them again. Called by ingestion inside its frame transaction.
+    """
+    con.execute(CLEANED_MATCHES_SQL)
+    con.execute(f"DELETE FROM {CLEANED_TABLE} WHERE match_id IN (SELECT unnest(?::VARCHAR[]))",
+                [[str(match_id) for match_id in match_ids]])
+
+
+def clean_point_by_point(con, match_ids=None, rebuild=False, chunk_size=5000, workers=None, in_flight=None):
+    """
+    Clean the point-by-point rows of matches not cleaned yet (or of match_ids) into
+    sofascore_point_by_point_clean.
+
+    Chunks of matches are read from DuckDB in the main process and cleaned in a process pool;
+    at most in_flight chunks are pending at once. Matches are recorded in
+    sofascore_point_by_point_cleaned, including those the cleaning drops, so reruns only pick
+    up new matches and those whose raw points ingestion replaced (see mark_stale).
+    rebuild=True drops both tables and cleans every match again.
+    """
+    if rebuild:
+        con.execute(f"DROP TABLE IF EXISTS {CLEAN_TABLE}")
+        con.execute(f"DROP TABLE IF EXISTS {CLEANED_TABLE}")
+    con.execute(CLEAN_TABLE_SQL)
+    con.execute(CLEANED_MATCHES_SQL)
+    if match_ids is None:
+        match_ids = [row[0] for row in con.execute(NEW_MATCHES_SQL).fetchall()]
+    match_ids = [str(match_id) for match_id in match_ids]
+    chunks = [match_ids[i:i + chunk_size] for i in range(0, len(match_ids), chunk_size)]
+    print(f"point-by-point: {len(match_ids)} matches to clean in {len(chunks)} chunks")
+
+    workers = workers or os.cpu_count()
+    in_flight = in_flight or 2 * workers
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(clean_chunk, load_chunk(con, chunk))))
+            if len(pending) >= in_flight:
+                write_chunk(con, *pending.popleft())
+        while pending:
+            write_chunk(con, *pending.popleft())
@@ -0,0 +1,179 @@
+import glob
+import json
+import logging
+import os
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+STORE_FOLDER = os.path.join('E:/', 'Data', 'tennis', 'sofascore', 'store')
+INDEX_FILE = 'index.tsv'
+
+
+def read_frame(path, offset, length):
+    """Lines of one compressed frame of a shard."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return zstandard.ZstdDecompressor().decompress(f.read(length)).decode('utf-8').split('\n')
+
+
+def parse_index_line(line):
+    """(key, (shard, offset, length, position)) of one index.tsv line, or None if it is malformed."""
+    try:
+        key, shard, offset, length, position = line.decode('utf-8').split('\t')
+        return key, (int(shard), int(offset), int(length), int(position))
+    except ValueError:
+        return None
+
+
+def load_index(index_path):
+    """
+    The entries of index.tsv. Only newline-terminated lines are trusted: an unterminated last
+    line is what a crash part way through an append leaves, so it is cut off the file (its
+    keys are just not stored yet). Malformed lines elsewhere are skipped. Both are logged.
+    """
+    with open(index_path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    index, end = {}, 0
+    for number, line in enumerate(lines[:-1], 1):
+        entry = parse_index_line(line)
+        if entry is None:
+            logger.warning(f"{index_path}: skipping malformed line {number}")
+        else:
+            index[entry[0]] = entry[1]
+        end += len(line) + 1
+    if lines[-1]:
+        logger.warning(f"{index_path}: truncating incomplete last line {len(lines)} ({len(lines[-1])} bytes)")
+        with open(index_path, 'r+b') as f:
+            f.truncate(end)
+    return index
+
+
+class RawStore:
+    """
+    Append-only store of raw API responses for one endpoint.
+
+    Responses are written as JSONL lines ({"key": ..., "data": ...}), compressed with zstd in
+    frames of frame_records lines and appended to shard files of up to shard_bytes. index.tsv
+    maps every key to its shard, frame offset, frame length and line, so membership is a dict
+    lookup and a single response is read back by decompressing one frame. Writing a key
+    again points the index at the new copy.
+
+    Each flush syncs its frame to disk before appending the frame's index lines in one write,
+    which is synced too; a crash can at worst leave a torn last index line, which opening the
+    store cuts off (see load_index).
+    """
+
+    def __init__(self, folder, frame_records=256, shard_bytes=256 * 2 ** 20, level=10):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.frame_records = frame_records
+        self.shard_bytes = shard_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.index = {}
+        self.pending = {}
+
+        index_path = os.path.join(folder, INDEX_FILE)
+        if os.path.exists(index_path):
+            self.index = load_index(index_path)
+
+        shards = [int(os.path.basename(path)[6:11]) for path in glob.glob(os.path.join(folder, 'shard-*.jsonl.zst'))]
+        self.shard = max(shards, default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, key):
+        key = str(key)
+        return key in self.index or key in self.pending
+
+    def __len__(self):
+        return len(self.index.keys() | self.pending.keys())
+
+    def keys(self):
+        return self.index.keys() | self.pending.keys()
+
+    def shard_path(self, shard):
+        return os.path.join(self.folder, f'shard-{shard:05d}.jsonl.zst')
+
+    def put(self, key, data):
+        key = str(key)
+        self.pending[key] = json.dumps({'key': key, 'data': data}, separators=(',', ':'))
+        if len(self.pending) >= self.frame_records:
+            self.flush()
+
+    def flush(self):
+        """Compress pending responses into one frame and index them."""
+        if not self.pending:
+            return
+
+        frame = self.compressor.compress('\n'.join(self.pending.values()).encode('utf-8') + b'\n')
+        path = self.shard_path(self.shard)
+        if os.path.exists(path) and os.path.getsize(path) + len(frame) > self.shard_bytes:
+            self.shard += 1
+            path = self.shard_path(self.shard)
+
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The index is written after its frame, so an interrupted flush leaves no dangling keys
+        entries = {key: (self.shard, offset, len(frame), position) for position, key in enumerate(self.pending)}
+        lines = ''.join(f'{key}\t' + '\t'.join(map(str, entry)) + '\n' for key, entry in entries.items())
+        with open(os.path.join(self.folder, INDEX_FILE), 'ab') as f:
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.index.update(entries)
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+
+    def get(self, key):
+        key = str(key)
+        if key in self.pending:
+            return json.loads(self.pending[key])['data']
+        shard, offset, length, position = self.index[key]
+        return json.loads(read_frame(self.shard_path(shard), offset, length)[position])['data']
+
+    def frames(self):
+        """{(shard, offset, length): lines holding the latest copy of a key}, in shard order."""
+        self.flush()
+        frames = {}
+        for shard, offset, length, position in self.index.values():
+            frames.setdefault((shard, offset, length), []).append(position)
+        return {frame: sorted(frames[frame]) for frame in sorted(frames)}
+
+    def items(self):
+        """(key, data) for the latest copy of every stored key, in shard order."""
+        for (shard, offset, length), positions in self.frames().items():
+            lines = read_frame(self.shard_path(shard), offset, length)
+            for position in positions:
+                record = json.loads(lines[position])
+                yield record['key'], record['data']
+
+
+def import_json_files(store, folder, prefix):
+    """Copy legacy one-file-per-response downloads ({prefix}{key}.json) into a store."""
+    for path in glob.glob(os.path.join(folder, f'{prefix}*.json')):
+        key = os.path.basename(path)[len(prefix):-len('.json')]
+        if key in store:
+            continue
+        with open(path) as f:
+            store.put(key, json.load(f))
+    store.flush()
+
+
+if __name__ == "__main__":
+    # One-off copy of the per-file downloads into the store
+    legacy_folder = os.path.join('E:/', 'Data', 'tennis', 'sofascore')
+    for folder, prefix in [('events', 'tennis_events_'), ('match-stats', 'match_stat_'), ('point-by-point', 'pbp_')]:
+        with RawStore(os.path.join(STORE_FOLDER, folder)) as store:
+            import_json_files(store, os.path.join(legacy_folder, folder), prefix)
+            print(f"{folder}: {len(store)} responses stored")
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from aiohttp import web
+
+from client import ENDPOINTS, SofaScoreClient
+
+ENDPOINT = ENDPOINTS['statistics']
+
+
+class StubServer:
+    """
+    A local SofaScore stand-in. Each key is served its scripted (status, headers) responses in
+    turn, then 200s; every request's key and arrival time are recorded.
+    """
+
+    def __init__(self, script):
+        self.script = {key: list(responses) for key, responses in script.items()}
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        key = request.match_info['key']
+        self.requests.append((key, time.monotonic()))
+        responses = self.script.get(key)
+        if responses:
+            status, headers = responses.pop(0)
+            return web.Response(status=status, headers=headers)
+        return web.json_response({'statistics': [], 'key': key})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/event/{key}/statistics', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+    def times(self, key):
+        return [at for requested, at in self.requests if requested == key]
+
+
+def run(script, keys, **client_args):
+    """Download keys from a stub server running script; returns the results, saved responses, server and client."""
+    saved = {}
+
+    async def main():
+        async with StubServer(script) as server:
+            args = {'concurrency': 2, 'max_rate': 100, 'min_rate': 50, 'backoff': 0.05, **client_args}
+            async with SofaScoreClient(base_url=server.url, **args) as client:
+                results = await client.download(ENDPOINT, keys, save=saved.__setitem__)
+            return results, server, client
+
+    results, server, client = asyncio.run(main())
+    return results, saved, server, client
+
+
+def test_server_errors_back_off_and_retry():
+    results, saved, server, client = run({'1': [(503, {}), (500, {})]}, ['1'], max_retries=3)
+
+    assert results == {'saved': 1, 'retried': 2, 'failed': 0}
+    assert saved['1']['key'] == '1'
+    times = server.times('1')
+    assert len(times) == 3
+    # Exponential backoff with jitter: at least half of backoff * 2 ** attempt between attempts
+    assert times[1] - times[0] >= 0.05 * 0.5
+    assert times[2] - times[1] >= 0.05 * 2 * 0.5
+    # Each error halved the rate, each success only nudges it back up
+    assert client.bucket.rate < client.max_rate
+
+
+def test_rate_limit_retries_after_retry_after():
+    results, saved, server, _ = run({'1': [(429, {'Retry-After': '1'})]}, ['1'], backoff=0.01)
+
+    assert results == {'saved': 1, 'retried': 1, 'failed': 0}
+    times = server.times('1')
+    assert len(times) == 2
+    # Retry-After, not the 0.01s backoff, sets the pause
+    assert times[1] - times[0] >= 0.95
+
+
+def test_rate_limit_pauses_every_worker():
+    results, _, server, _ = run({'1': [(429, {'Retry-After': '1'})]}, ['1', '2', '3', '4'], concurrency=1)
+
+    assert results['saved'] == 4
+    first_429 = server.times('1')[0]
+    # Keys requested after the 429 waited out the pause too
+    later = [at for key, at in server.requests if at > first_429]
+    assert later and min(later) - first_429 >= 0.95
+
+
+def test_retries_stop_at_max_retries():
+    results, saved, server, _ = run({'1': [(500, {})] * 10}, ['1', '2'], max_retries=3)
+
+    assert results == {'saved': 1, 'retried': 2, 'failed': 1}
+    assert '1' not in saved and '2' in saved
+    assert len(server.times('1')) == 3
+
+
+def test_not_found_is_skipped_without_retry_or_pause():
+    results, saved, server, client = run({'1': [(404, {})]}, ['1', '2'])
+
+    assert results == {'saved': 1, 'retried': 0, 'failed': 1}
+    assert '1' not in saved and '2' in saved
+    assert len(server.times('1')) == 1
+    assert client.paused_until == 0.0
+    assert client.bucket.rate == client.max_rate
@@ -0,0 +1,256 @@
+import bz2
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from unittest.mock import patch
+import duckdb
+import numpy as np
+
+from market_catalog import CATALOG_TABLE
+
+TICK_STORE_FOLDER = 'E:/Data/tennis/tick-store/'
+TICKS_SUFFIX = '.ticks.npz'
+META_SUFFIX = '.ticks.json'
+# tick_replay stands in for a private method of flumine's historical stream; the versions it was checked against
+FLUMINE_VERSIONS = ('3.2.',)
+
+# One row per market change, definition, runner change or ladder level of a stream line
+TICK_DTYPE = np.dtype([
+    ('update', '<u4'), ('publish_time', '<i8'), ('market', '<u2'), ('kind', 'u1'), ('selection_id', '<i8'),
+    ('handicap', '<f4'), ('level', '<i4'), ('price', '<f8'), ('size', '<f8'),
+])
+
+# Tick kinds. MARKET starts a market change (level 1 if it is an image), DEFINITION points level at
+# the market's definitions and RUNNER starts a runner change; the kinds after it belong to that runner
+MARKET, DEFINITION, MARKET_TV, RUNNER, TRD_CLEAR = range(5)
+VALUE_KINDS = {'ltp': 5, 'spn': 6, 'spf': 7, 'tv': 8}
+LADDER_KINDS = {'trd': 9, 'atb': 10, 'atl': 11, 'spb': 12, 'spl': 13}
+LEVEL_LADDER_KINDS = {'batb': 14, 'batl': 15, 'bdatb': 16, 'bdatl': 17}
+KIND_KEYS = {kind: key for keys in [VALUE_KINDS, LADDER_KINDS, LEVEL_LADDER_KINDS] for key, kind in keys.items()}
+
+
+def tick_path(market_id, folder=TICK_STORE_FOLDER):
+    return os.path.join(folder, market_id + TICKS_SUFFIX)
+
+
+def encode_stream(lines):
+    """Ticks and metadata (market ids, market definitions) of the lines of a market stream file."""
+    rows, market_ids, definitions = [], {}, {}
+    for update, line in enumerate(lines):
+        data = json.loads(line)
+        publish_time = data['pt']
+        for change in data.get('mc', []):
+            market = market_ids.setdefault(change['id'], len(market_ids))
+            rows.append((update, publish_time, market, MARKET, 0, 0, int(change.get('img', False)), 0, 0))
+            if 'marketDefinition' in change:
+                # Definitions are often resent unchanged, so each distinct one is kept once
+                definition = json.dumps(change['marketDefinition'], separators=(',', ':'))
+                rows.append((update, publish_time, market, DEFINITION, 0, 0,
+                             definitions.setdefault(definition, len(definitions)), 0, 0))
+            if 'tv' in change:
+                rows.append((update, publish_time, market, MARKET_TV, 0, 0, 0, 0, change['tv']))
+            for runner in change.get('rc', []):
+                selection_id, handicap = runner['id'], runner.get('hc', 0)
+                rows.append((update, publish_time, market, RUNNER, selection_id, handicap, 0, 0, 0))
+                for key, kind in VALUE_KINDS.items():
+                    if key in runner:
+                        rows.append((update, publish_time, market, kind, selection_id, handicap, 0,
+                                     runner[key] if key != 'tv' else 0, runner[key] if key == 'tv' else 0))
+                if 'trd' in runner and not runner['trd']:
+                    rows.append((update, publish_time, market, TRD_CLEAR, selection_id, handicap, 0, 0, 0))
+                for key, kind in LADDER_KINDS.items():
+                    for price, size in runner.get(key) or []:
+                        rows.append((update, publish_time, market, kind, selection_id, handicap, 0, price, size))
+                for key, kind in LEVEL_LADDER_KINDS.items():
+                    for level, price, size in runner.get(key) or []:
+                        rows.append((update, publish_time, market, kind, selection_id, handicap, level, price, size))
+    ticks = np.array(rows, dtype=TICK_DTYPE)
+    return ticks, {'market_ids': list(market_ids), 'definitions': [json.loads(definition) for definition in definitions]}
+
+
+def _narrow(values):
+    # values in the smallest integer type that holds them all
+    for dtype in (np.int8, np.int16, np.int32):
+        if not len(values) or (values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max):
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def pack_ticks(ticks):
+    """
+    The columns of ticks as they are stored: update, publish time and selection id as their
+    first value and the steps after it, prices and sizes as whole cents where that is exact
+    (Betfair's are), every integer in the narrowest type that holds it. Compressed, they come
+    to about the size of the bz2 file, where the raw ticks are over ten times it.
+    """
+    columns = {}
+    for name in TICK_DTYPE.names:
+        values = ticks[name]
+        if name in ('update', 'publish_time', 'selection_id'):
+            values = values.astype(np.int64)
+            columns[name] = _narrow(values[:1])
+            columns[name + '_step'] = _narrow(np.diff(values))
+        elif name in ('price', 'size'):
+            cents = np.round(values * 100)
+            columns[name] = _narrow(cents.astype(np.int64)) if np.array_equal(cents / 100, values) else values
+        elif name == 'level':
+            columns[name] = _narrow(values)
+        else:
+            columns[name] = values
+    return columns
+
+
+def unpack_ticks(columns):
+    """The ticks of columns written by pack_ticks, exactly as they were encoded."""
+    ticks = np.empty(len(columns['kind']), dtype=TICK_DTYPE)
+    for name in TICK_DTYPE.names:
+        values = columns[name]
+        if name in ('update', 'publish_time', 'selection_id'):
+            values = np.cumsum(np.concatenate([values, columns[name + '_step']]), dtype=np.int64)
+        elif name in ('price', 'size') and values.dtype.kind == 'i':
+            values = values / 100
+        ticks[name] = values
+    return ticks
+
+
+def is_current(tick_file, path):
+    """Whether tick_file was converted from the market file at path as it is now."""
+    return os.path.exists(tick_file) and os.path.getmtime(tick_file) >= os.path.getmtime(path)
+
+
+def convert_market_file(path, folder=TICK_STORE_FOLDER):
+    """Decode one bz2 market file into the tick store, once; returns the tick file's path."""
+    market_id = os.path.basename(path)[:-len('.bz2')]
+    out_path = tick_path(market_id, folder)
+    if is_current(out_path, path):
+        return out_path
+    try:
+        with bz2.open(path, 'rt') as f:
+            ticks, meta = encode_stream(f)
+    except (OSError, EOFError, ValueError) as e:
+        print(f"Error converting {path}: {e}")
+        return None
+    # The ticks are written last, so a file that exists always has its metadata
+    with open(out_path[:-len(TICKS_SUFFIX)] + META_SUFFIX, 'w') as f:
+        json.dump(meta, f, separators=(',', ':'))
+    np.savez_compressed(out_path + '.tmp.npz', **pack_ticks(ticks))
+    os.replace(out_path + '.tmp.npz', out_path)
+    return out_path
+
+
+def convert_market_files(paths, folder=TICK_STORE_FOLDER, workers=None):
+    os.makedirs(folder, exist_ok=True)
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(convert_market_file, paths, [folder] * len(paths), chunksize=16))
+
+
+class TickFile:
+    """
+    A converted market file. ticks is the decoded array for columnar use; updates() rebuilds
+    the stream's market changes line by line for replay.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as columns:
+            self.ticks = unpack_ticks(columns)
+        with open(path[:-len(TICKS_SUFFIX)] + META_SUFFIX) as f:
+            meta = json.load(f)
+        self.market_ids = meta['market_ids']
+        self.definitions = meta['definitions']
+
+    def updates(self):
+        """(publish_time, market changes) for every line of the original stream, as parsed from it."""
+        columns = [self.ticks[name].tolist() for name in TICK_DTYPE.names]
+        market_ids, definitions = self.market_ids, self.definitions
+        current, publish_time, changes, change, runner = None, None, None, None, None
+        for update, pt, market, kind, selection_id, handicap, level, price, size in zip(*columns):
+            if update != current:
+                if current is not None:
+                    yield publish_time, changes
+                current, publish_time, changes = update, pt, []
+
+            if kind == MARKET:
+                change = {'id': market_ids[market]}
+                if level:
+                    change['img'] = True
+                changes.append(change)
+            elif kind == RUNNER:
+                runner = {'id': selection_id}
+                if handicap:
+                    runner['hc'] = handicap
+                change.setdefault('rc', []).append(runner)
+            elif kind == DEFINITION:
+                change['marketDefinition'] = definitions[level]
+            elif kind == MARKET_TV:
+                change['tv'] = size
+            elif kind == TRD_CLEAR:
+                runner['trd'] = []
+            elif kind >= LEVEL_LADDER_KINDS['batb']:
+                runner.setdefault(KIND_KEYS[kind], []).append([level, price, size])
+            elif kind >= LADDER_KINDS['trd']:
+                runner.setdefault(KIND_KEYS[kind], []).append([price, size])
+            else:
+                runner[KIND_KEYS[kind]] = size if kind == VALUE_KINDS['tv'] else price
+        if current is not None:
+            yield publish_time, changes
+
+
+def _replay_read_loop(stream):
+    # flumine's historical read loop, with the decoded changes handed straight to the market stream
+    unique_id = stream.unique_id
+    stream.listener.register_stream(unique_id, stream.operation)
+    process = stream.listener.stream._process
+    caches = stream.listener.stream._caches
+    for publish_time, changes in TickFile(stream.file_path).updates():
+        if process(changes, publish_time):
+            yield [cache.create_resource(unique_id, snap=True) for cache in caches.values() if cache.active]
+
+
+def check_flumine():
+    """Raise if the installed flumine is not one tick_replay was checked against."""
+    import flumine
+    if not flumine.__version__.startswith(FLUMINE_VERSIONS):
+        raise RuntimeError(f"tick_replay replaces a private flumine method and was checked against flumine "
+                           f"{', '.join(v + 'x' for v in FLUMINE_VERSIONS)}, not {flumine.__version__}; "
+                           f"replay the bz2 market files instead, or check _replay_read_loop against this version")
+
+
+@contextmanager
+def tick_replay():
+    """Inside this, flumine simulations replay market files ending in .ticks.npz from the tick store."""
+    check_flumine()
+    from flumine.streams import betfairhistoricalstream as historical_stream
+    generator_stream = historical_stream.FlumineHistoricalGeneratorStream
+    read_loop = generator_stream._read_loop
+
+    def _read_loop(self):
+        if str(self.file_path).endswith(TICKS_SUFFIX):
+            return _replay_read_loop(self)
+        return read_loop(self)
+
+    with patch.object(generator_stream, '_read_loop', _read_loop):
+        yield
+
+
+def tick_files(paths, folder=TICK_STORE_FOLDER):
+    """
+    Each bz2 market file's converted tick file where there is one converted since the bz2 file
+    last changed, else the bz2 file.
+    """
+    converted = []
+    for path in paths:
+        market_tick_path = tick_path(os.path.basename(path)[:-len('.bz2')], folder)
+        converted.append(market_tick_path if is_current(market_tick_path, path) else path)
+    return converted
+
+
+if __name__ == "__main__":
+    # Convert every catalogued market file not yet in the tick store
+    con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
+    paths = [row[0] for row in con.execute(f"SELECT path FROM {CATALOG_TABLE} ORDER BY market_id").fetchall()]
+    con.close()
+
+    converted = convert_market_files(paths)
+    print(f"{sum(path is not None for path in converted)} of {len(paths)} market files in the tick store")
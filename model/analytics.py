@@ -0,0 +1,228 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.metrics import brier_score_loss, log_loss
+
+COMMISSION = 0.05
+SIMULATION_OUTPUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulation', 'outputs')
+BREAKDOWN_COLUMNS = ['tournament_category', 'tournament_points', 'tournament_round_category']
+
+ORDERS_TABLE = 'simulation_orders'
+ORDER_FILES_TABLE = 'simulation_order_files'
+
+ORDERS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {ORDERS_TABLE} (
+    model_id VARCHAR,
+    bet_id VARCHAR,
+    strategy_name VARCHAR,
+    market_id VARCHAR,
+    selection_id BIGINT,
+    trade_id VARCHAR,
+    date_time_placed TIMESTAMP,
+    price DOUBLE,
+    price_matched DOUBLE,
+    size DOUBLE,
+    size_matched DOUBLE,
+    side VARCHAR,
+    elapsed_seconds_executable DOUBLE,
+    order_status VARCHAR,
+    profit DOUBLE
+)
+"""
+
+ORDER_FILES_SQL = f"""
+CREATE TABLE IF NOT EXISTS {ORDER_FILES_TABLE} (
+    model_id VARCHAR PRIMARY KEY,
+    path VARCHAR,
+    mtime DOUBLE
+)
+"""
+
+
+def h2h_profit(df, home_bet_col='home_bet', away_bet_col='away_bet', home_price_col='pp_ltp_home',
+               away_price_col='pp_ltp_away', winner_col='winner_home', commission=COMMISSION):
+    """
+    Profit of head-to-head bets staked in home_bet_col / away_bet_col at the home/away prices,
+    after commission on winnings. A row bets home if home_bet_col > 0, else away if away_bet_col > 0.
+    """
+    home_bet, away_bet = df[home_bet_col].to_numpy(), df[away_bet_col].to_numpy()
+    home_won = (df[winner_col] == 1).to_numpy()
+    away_won = (df[winner_col] == 0).to_numpy()
+    home_profit = np.where(home_won, home_bet * (df[home_price_col].to_numpy() - 1.0) * (1 - commission), -home_bet)
+    away_profit = np.where(away_won, away_bet * (df[away_price_col].to_numpy() - 1.0) * (1 - commission), -away_bet)
+    return pd.Series(np.where(home_bet > 0, home_profit, np.where(away_bet > 0, away_profit, 0.0)), index=df.index)
+
+
+def runner_profit(stake, price, result, commission=COMMISSION):
+    """Profit of backing runners for stake at price, by their WINNER/LOSER result; 0 for any other result."""
+    stake = np.asarray(stake, dtype=np.float64)
+    result = np.asarray(result)
+    return np.select([result == 'WINNER', result == 'LOSER'],
+                     [stake * (np.asarray(price, dtype=np.float64) - 1) * (1 - commission), -stake], 0.0)
+
+
+def net_profit(profit, commission=COMMISSION):
+    """Order profit with commission taken off winning orders."""
+    profit = np.asarray(profit, dtype=np.float64)
+    return np.where(profit > 0, profit * (1 - commission), profit)
+
+
+def max_drawdown(cumulative_profit):
+    """Largest fall of a cumulative profit series from its running peak (starting from 0)."""
+    cumulative_profit = np.asarray(cumulative_profit, dtype=np.float64)
+    if len(cumulative_profit) == 0:
+        return 0.0
+    peak = np.maximum.accumulate(np.maximum(cumulative_profit, 0.0))
+    return float((peak - cumulative_profit).max())
+
+
+def order_performance(orders, commission=COMMISSION):
+    """
+    Orders in placement order with net profit, cumulative profit and turnover, and POT (profit
+    over turnover) so far.
+    """
+    orders = orders.sort_values(['date_time_placed', 'bet_id'], kind='stable').copy()
+    orders['profit_minus_commission'] = net_profit(orders['profit'], commission)
+    orders['cumulative_profit'] = orders['profit_minus_commission'].cumsum()
+    orders['total_matched_cum'] = orders['size_matched'].cumsum()
+    orders['total_orders'] = range(len(orders))
+    orders['pot'] = orders['cumulative_profit'] / orders['total_matched_cum']
+    return orders
+
+
+def summarise_orders(orders, commission=COMMISSION):
+    """Markets, orders, turnover, net profit, POT, ROI (profit over requested stake) and max drawdown."""
+    orders = order_performance(orders, commission)
+    profit = orders['profit_minus_commission'].sum()
+    matched = orders['size_matched'].sum()
+    staked = orders['size'].sum()
+    return {
+        'markets': orders['market_id'].nunique(),
+        'orders': len(orders),
+        'turnover': matched,
+        'profit': profit,
+        'pot': profit / matched if matched else np.nan,
+        'roi': profit / staked if staked else np.nan,
+        'max_drawdown': max_drawdown(orders['cumulative_profit']),
+    }
+
+
+def orders_breakdown(orders, by, commission=COMMISSION):
+    """summarise_orders for each group of by (columns of orders)."""
+    return pd.DataFrame([{**dict(zip(by, key if isinstance(key, tuple) else (key,))), **summarise_orders(group, commission)}
+                         for key, group in orders.groupby(by, dropna=False, observed=True)])
+
+
+def prediction_metrics(y_true, y_pred):
+    """Brier score and log loss of predicted win probabilities."""
+    return {'brier': brier_score_loss(y_true, y_pred), 'log_loss': log_loss(y_true, y_pred, labels=[0, 1])}
+
+
+def orders_path(model_id, folder=SIMULATION_OUTPUTS):
+    # Written by run-simulation.py's merge_orders
+    return os.path.join(folder, f'{model_id}.parquet')
+
+
+def load_orders(con, model_ids, folder=SIMULATION_OUTPUTS):
+    """
+    Load the order logs of model_ids into the simulation_orders table. A model's orders are
+    only (re)loaded when its log is new or has changed since it was last loaded; returns the
+    model ids loaded.
+    """
+    con.execute(ORDERS_SQL)
+    con.execute(ORDER_FILES_SQL)
+    loaded = {model_id: (path, mtime) for model_id, path, mtime in
+              con.execute(f"SELECT model_id, path, mtime FROM {ORDER_FILES_TABLE}").fetchall()}
+    changed = []
+    for model_id in model_ids:
+        path = orders_path(model_id, folder)
+        if os.path.exists(path) and loaded.get(model_id) != (path, os.path.getmtime(path)):
+            changed.append((model_id, path, os.path.getmtime(path)))
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        for model_id, path, mtime in changed:
+            con.execute(f"DELETE FROM {ORDERS_TABLE} WHERE model_id = ?", [model_id])
+            con.execute(f"INSERT INTO {ORDERS_TABLE} BY NAME SELECT ? AS model_id, * FROM read_parquet(?)",
+                        [model_id, path])
+            con.execute(f"INSERT OR REPLACE INTO {ORDER_FILES_TABLE} VALUES (?, ?, ?)", [model_id, path, mtime])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return [model_id for model_id, _, _ in changed]
+
+
+def _performance_sql(by, commission):
+    # Net profit, POT, ROI and max drawdown per group of by, in placement order within each group
+    keys = ', '.join(by)
+    partition = f'PARTITION BY {keys}' if by else ''
+    return f"""
+    WITH orders AS (
+        SELECT
+            o.*,
+            m.tournament_category,
+            m.tournament_points,
+            m.tournament_round_category,
+            CASE WHEN o.profit > 0 THEN o.profit * (1 - {commission}) ELSE o.profit END AS net_profit
+        FROM {ORDERS_TABLE} o
+        LEFT JOIN (
+            SELECT market_id, ANY_VALUE(tournament_category) AS tournament_category,
+                ANY_VALUE(tournament_points) AS tournament_points,
+                ANY_VALUE(tournament_round_category) AS tournament_round_category
+            FROM base_table
+            WHERE market_id IS NOT NULL
+            GROUP BY market_id
+        ) m ON o.market_id = m.market_id
+        WHERE o.model_id = ?
+    ),
+    running AS (
+        SELECT
+            *,
+            SUM(net_profit) OVER (
+                {partition} ORDER BY date_time_placed, bet_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS cumulative_profit
+        FROM orders
+    )
+    SELECT
+        {keys + ',' if by else ''}
+        COUNT(DISTINCT market_id) AS markets,
+        COUNT(*) AS orders,
+        SUM(size_matched) AS turnover,
+        SUM(net_profit) AS profit,
+        SUM(net_profit) / NULLIF(SUM(size_matched), 0) AS pot,
+        SUM(net_profit) / NULLIF(SUM(size), 0) AS roi,
+        MAX(peak - cumulative_profit) AS max_drawdown
+    FROM (
+        SELECT
+            *,
+            GREATEST(MAX(cumulative_profit) OVER (
+                {partition} ORDER BY date_time_placed, bet_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ), 0) AS peak
+        FROM running
+    )
+    {'GROUP BY ' + keys + ' ORDER BY ' + keys if by else ''}
+    """
+
+
+def evaluate_model(con, model_id, by=BREAKDOWN_COLUMNS, commission=COMMISSION, folder=SIMULATION_OUTPUTS):
+    """
+    Everything about one model's simulated orders in one call, computed in DuckDB: the overall
+    summary, one breakdown per column of by (joined from base_table on market_id) and POT over
+    time. The order log is loaded first if it is new or has changed.
+    """
+    load_orders(con, [model_id], folder)
+    results = {'summary': con.execute(_performance_sql([], commission), [model_id]).df()}
+    for column in by:
+        results[column] = con.execute(_performance_sql([column], commission), [model_id]).df()
+    results['pot_over_time'] = con.execute(f"""
+    SELECT
+        date_time_placed,
+        SUM(CASE WHEN profit > 0 THEN profit * (1 - {commission}) ELSE profit END) OVER w
+            / NULLIF(SUM(size_matched) OVER w, 0) AS pot
+    FROM {ORDERS_TABLE}
+    WHERE model_id = ?
+    WINDOW w AS (ORDER BY date_time_placed, bet_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    ORDER BY date_time_placed, bet_id
+    """, [model_id]).df()
+    return results
@@ -0,0 +1,67 @@
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+
+from features import last_n_features, rolling_before_match
+
+# Raw match stats present in base_table, standing in for the notebook's derived stats_to_roll_columns
+stats_to_roll_columns = ['aces', 'doubleFaults', 'breakPointsSaved', 'breakPointsScored', 'firstServeAccuracy',
+                         'secondServeAccuracy', 'maxGamesInRow', 'receiverPointsScored', 'tiebreaks']
+
+
+def pandas_last_n(base_table, windows):
+    # The train-model notebook's last_N block
+    grouped_winner = base_table.groupby('index')
+    columns = {}
+    for name, column in [('wins', 'winner'), ('gained_elo', 'gained_elo'), ('pbp_mean', 'winrate_mean'),
+                         ('pbp_min', 'winrate_min'), ('pbp_max', 'winrate_max'), ('pbp_std', 'winrate_std')]:
+        for window in windows:
+            columns[f'last_{window}_{name}'] = grouped_winner[column].transform(
+                lambda x: x.rolling(window=window, min_periods=1).sum().shift(1))
+    for window in windows:
+        matches = grouped_winner['winner'].transform(lambda x: x.rolling(window=window, min_periods=1).count().shift(1))
+        columns[f'last_{window}_matches'] = matches.fillna(0)
+        columns[f'last_{window}_wl_pct'] = (columns[f'last_{window}_wins'] / matches.replace(0, np.nan)).fillna(0)
+        columns[f'last_{window}_wins'] = columns[f'last_{window}_wins'].fillna(0)
+    return pd.DataFrame(columns)
+
+
+def pandas_rolling_means(base_table):
+    # The train-model notebook's mean_*_last_10 block
+    stats_df = pd.DataFrame(base_table[['index'] + stats_to_roll_columns], index=base_table.index)
+    rolling_means = stats_df.groupby('index')[stats_to_roll_columns].apply(
+        lambda x: x.rolling(window=10, min_periods=1).mean().shift(1)
+    )
+    rolling_means = rolling_means.reset_index(level=0, drop=True)
+    rolling_means.columns = [f'mean_{col}_last_10' for col in rolling_means.columns]
+    return rolling_means
+
+
+con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
+base_table = con.execute("SELECT * FROM base_table").df()
+con.close()
+
+base_table['gained_elo'] = base_table['post_match_elo'] - base_table['pre_match_elo']
+for col in stats_to_roll_columns:
+    base_table[col] = pd.to_numeric(base_table[col])
+base_table.sort_values('datetime', inplace=True)
+windows = [1, 3, 5, 10]
+print(f"{len(base_table)} rows, {base_table['index'].nunique()} players")
+
+start = time.perf_counter()
+expected_last_n = pandas_last_n(base_table, windows)
+expected_means = pandas_rolling_means(base_table)
+pandas_time = time.perf_counter() - start
+
+start = time.perf_counter()
+last_n = last_n_features(base_table, windows)
+means = rolling_before_match(base_table, stats_to_roll_columns, [10], how='mean')
+kernel_time = time.perf_counter() - start
+
+means = pd.DataFrame({f'mean_{col}_last_10': means[col, 10] for col in stats_to_roll_columns}, index=base_table.index)
+pd.testing.assert_frame_equal(last_n, expected_last_n[last_n.columns], check_exact=True)
+pd.testing.assert_frame_equal(means, expected_means.loc[means.index], check_exact=True)
+
+print(f"pandas groupby/rolling: {pandas_time:.2f}s")
+print(f"segmented kernel:       {kernel_time:.2f}s ({pandas_time / kernel_time:.1f}x)")
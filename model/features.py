@@ -0,0 +1,396 @@
+import pickle
+import numpy as np
+import pandas as pd
+
+# Columns that get their own career_* feature set per player
+CAREER_COLUMNS = ['groundType', 'tournament_points', 'tournament_round_category', 'tournament_name']
+
+# Per-match values accumulated for every key, and the feature name each becomes
+ACCUMULATED_COLUMNS = {
+    'winner': 'wins',
+    'gained_elo': 'gained_elo',
+    'winrate_mean': 'pbp_mean',
+    'winrate_min': 'pbp_min',
+    'winrate_max': 'pbp_max',
+    'winrate_std': 'pbp_std',
+}
+N_VALUES = len(ACCUMULATED_COLUMNS)
+
+
+def segment_steps(codes):
+    """
+    Lay rows out as contiguous segments per key (keeping row order within a key).
+
+    Returns the sorting order, each row's position in it, and the rows grouped by their
+    position within their key: steps[k] holds the k-th row of every key that has one.
+    """
+    n = len(codes)
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    is_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+    segment_start = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    rank = position - segment_start[position]
+    by_rank = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+    return order, position, [by_rank[bounds[k]:bounds[k + 1]] for k in range(rank.max() + 1)]
+
+
+class KeyState:
+    """Running totals of the accumulated values for every key of one grouping, indexed by key code."""
+
+    def __init__(self, n_values=N_VALUES):
+        self.keys = None
+        self.matches = np.zeros(0, dtype=np.int64)
+        self.totals = np.zeros((0, n_values))
+        self.compensations = np.zeros((0, n_values))
+        self.previous_missing = np.zeros((0, n_values), dtype=bool)
+        self.last_elo_diff = np.zeros(0)
+
+    def codes(self, keys):
+        """Codes of keys into the state arrays, adding any keys not seen before."""
+        if self.keys is None:
+            codes, new_keys = keys.factorize()
+            self.keys = new_keys
+        else:
+            codes = self.keys.get_indexer(keys)
+            unseen = codes == -1
+            new_keys = keys[:0]
+            if unseen.any():
+                new_codes, new_keys = keys[unseen].factorize()
+                codes[unseen] = len(self.keys) + new_codes
+                self.keys = self.keys.append(new_keys)
+
+        n_new, n_values = len(new_keys), self.totals.shape[1]
+        self.matches = np.r_[self.matches, np.zeros(n_new, dtype=np.int64)]
+        self.totals = np.r_[self.totals, np.zeros((n_new, n_values))]
+        self.compensations = np.r_[self.compensations, np.zeros((n_new, n_values))]
+        self.previous_missing = np.r_[self.previous_missing, np.zeros((n_new, n_values), dtype=bool)]
+        self.last_elo_diff = np.r_[self.last_elo_diff, np.full(n_new, np.nan)]
+        return codes
+
+    def accumulate(self, codes, values, elo_diffs, update):
+        """
+        Totals, match counts and last elo diff of each row's key before that row, matching
+        groupby(...).cumsum().groupby(...).shift(1).fillna(0): a missing previous value shifts
+        a NaN in, which becomes 0.
+
+        Rows are taken in order. The k-th row of every key is handled in step k, so each step
+        is one vectorised update over distinct keys.
+        """
+        n = len(codes)
+        before = np.zeros((n, self.totals.shape[1]))
+        matches = np.zeros(n)
+        last_elo_diff = np.full(n, np.nan)
+        if n == 0:
+            return before, matches, last_elo_diff
+
+        _, _, steps = segment_steps(codes)
+        for rows in steps:
+            keys = codes[rows]
+            totals = self.totals[keys]
+            before[rows] = np.where(self.previous_missing[keys], 0.0, totals)
+            matches[rows] = self.matches[keys]
+            last_elo_diff[rows] = self.last_elo_diff[keys]
+            if not update:
+                continue
+
+            # Kahan summation, as used by pandas' grouped cumsum
+            row_values = values[rows]
+            present = ~np.isnan(row_values)
+            compensations = self.compensations[keys]
+            y = row_values - compensations
+            t = totals + y
+            compensation = t - totals - y
+            self.totals[keys] = np.where(present, t, totals)
+            self.compensations[keys] = np.where(present, np.nan_to_num(compensation, nan=0.0), compensations)
+            self.previous_missing[keys] = ~present
+            self.matches[keys] += 1
+            self.last_elo_diff[keys] = elo_diffs[rows]
+
+        return before, matches, last_elo_diff
+
+
+class PlayerStateEngine:
+    """
+    Leak-free "before this match" career, per-column career and head-to-head features for the
+    player rows of the base table, from one set of per-player and per-matchup accumulators.
+
+    The accumulators survive between calls, so a fitted engine can be saved, loaded and used
+    to score new matches (score) and absorb their results (update) without replaying history.
+    """
+
+    def __init__(self, columns=CAREER_COLUMNS):
+        self.columns = list(columns)
+        self.career = KeyState(1)
+        self.by_column = {col: KeyState() for col in self.columns}
+        self.h2h = KeyState()
+
+    def _walk(self, df, update):
+        values = df[list(ACCUMULATED_COLUMNS)].to_numpy(dtype=float)
+        elo_diffs = df['pre_match_elo_diff'].to_numpy(dtype=float)
+        players = df['index'].to_numpy()
+        n = len(df)
+
+        codes = self.career.codes(pd.Index(players))
+        career_wins, career_matches, _ = self.career.accumulate(codes, values[:, :1], elo_diffs, update)
+
+        stores = [(col, df[col], self.by_column[col]) for col in self.columns]
+        stores.append(('h2h', df['matchup_indices'], self.h2h))
+        grouped = {}
+        for name, key_values, store in stores:
+            # Rows with a missing key are dropped by groupby, leaving NaN counts
+            has_key = key_values.notna().to_numpy()
+            totals = np.zeros((n, N_VALUES))
+            matches = np.full(n, np.nan)
+            last_elo_diff = np.full(n, np.nan)
+
+            keys = pd.MultiIndex.from_arrays([players[has_key], key_values.to_numpy()[has_key]])
+            codes = store.codes(keys)
+            totals[has_key], matches[has_key], last_elo_diff[has_key] = store.accumulate(
+                codes, values[has_key], elo_diffs[has_key], update
+            )
+            grouped[name] = (totals, matches, last_elo_diff)
+
+        return self._to_frame(df, career_wins[:, 0], career_matches, grouped)
+
+    def _to_frame(self, df, career_wins, career_matches, grouped):
+        features = {
+            'career_wins': career_wins,
+            'career_matches': career_matches.astype(np.int64),
+        }
+        features['career_wl_pct'] = features['career_wins'] / features['career_matches']
+
+        for name, (totals, matches, _) in grouped.items():
+            if name == 'h2h':
+                prefix, suffix, pct_name = 'h2h_opponent_', '', 'win_pct'
+            else:
+                prefix, suffix, pct_name = 'career_', f'_{name}', 'wl_pct'
+
+            features[f'{prefix}wins{suffix}'] = totals[:, 0]
+            features[f'{prefix}matches{suffix}'] = matches if np.isnan(matches).any() else matches.astype(np.int64)
+            features[f'{prefix}{pct_name}{suffix}'] = totals[:, 0] / matches
+            features[f'{prefix}gained_elo{suffix}'] = totals[:, 1]
+            for i, column in enumerate(list(ACCUMULATED_COLUMNS.values())[2:], start=2):
+                features[f'{prefix}{column}{suffix}'] = totals[:, i] / matches
+
+        last_elo_diff = grouped['h2h'][2]
+        features['last_time_matchup_elo_diff'] = last_elo_diff
+        features['elo_diff_ratio_v_last'] = df['pre_match_elo_diff'].to_numpy() - last_elo_diff
+        return pd.DataFrame(features, index=df.index)
+
+    def transform(self, df):
+        """Features for every row of df (in time order), absorbing each match as it goes."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._walk(df, update=True)
+
+    def score(self, df):
+        """Features for upcoming matches from the current state, without updating it."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._walk(df, update=False)
+
+    def update(self, df):
+        """Absorb the results of matches already scored."""
+        self.transform(df)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path):
+        engine = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            engine.__dict__.update(pickle.load(f))
+        return engine
+
+
+def _rolling_result(how, nobs, total, neg_count, same_count, previous):
+    """Value of a window from its running state, as pandas' roll_sum / roll_mean compute it."""
+    if how == 'mean':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = total / nobs
+        result = np.where((neg_count == 0) & (result < 0), 0.0, result)
+        result = np.where((neg_count == nobs) & (result > 0), 0.0, result)
+    else:
+        result = total
+        previous = previous * nobs
+    # A run of identical values is returned without summation error
+    result = np.where(same_count >= nobs, previous, result)
+    return np.where(nobs > 0, result, np.nan)
+
+
+def rolling_before_match(df, columns, windows, how='sum', group_col='index'):
+    """
+    Rolling sum, count or mean of columns over each player's previous `window` rows, for every
+    window in one call. Matches
+    df.groupby(group_col)[col].transform(lambda x: x.rolling(window, min_periods=1).<how>().shift(1))
+    bit for bit, so df must already be in time order.
+
+    Rows are laid out as contiguous player segments and every window is stepped through all
+    segments at once, adding the newest value and removing the one falling out of the window
+    with the same compensated running sums pandas uses. Returns a dict of arrays keyed by
+    (column, window).
+    """
+    values = df[columns].to_numpy(dtype=float)
+    if how == 'count':
+        values = (~np.isnan(values)).astype(float)
+        how = 'sum'
+
+    codes, uniques = pd.factorize(df[group_col])
+    order, position, steps = segment_steps(codes)
+    shape = (len(uniques), len(columns))
+
+    results = {}
+    for window in windows:
+        out = np.full(values.shape, np.nan)
+        total = np.zeros(shape)
+        add_compensation = np.zeros(shape)
+        remove_compensation = np.zeros(shape)
+        nobs = np.zeros(shape, dtype=np.int64)
+        neg_count = np.zeros(shape, dtype=np.int64)
+        same_count = np.zeros(shape, dtype=np.int64)
+        previous = np.full(shape, np.nan)
+
+        for step, rows in enumerate(steps):
+            keys = codes[rows]
+            row_values = values[rows]
+            if step:
+                out[rows] = _rolling_result(how, nobs[keys], total[keys], neg_count[keys],
+                                            same_count[keys], previous[keys])
+
+            if step == 0 or window == 1:
+                # The window shares no rows with the previous one, so it is rebuilt from scratch
+                total[keys] = add_compensation[keys] = remove_compensation[keys] = 0.0
+                nobs[keys] = neg_count[keys] = same_count[keys] = 0
+                previous[keys] = row_values
+            elif step >= window:
+                dropped = values[order[position[rows] - window]]
+                present = ~np.isnan(dropped)
+                current = total[keys]
+                y = -dropped - remove_compensation[keys]
+                t = current + y
+                remove_compensation[keys] = np.where(present, t - current - y, remove_compensation[keys])
+                total[keys] = np.where(present, t, current)
+                nobs[keys] -= present
+                neg_count[keys] -= present & np.signbit(dropped)
+
+            present = ~np.isnan(row_values)
+            current = total[keys]
+            y = row_values - add_compensation[keys]
+            t = current + y
+            add_compensation[keys] = np.where(present, t - current - y, add_compensation[keys])
+            total[keys] = np.where(present, t, current)
+            nobs[keys] += present
+            neg_count[keys] += present & np.signbit(row_values)
+            same_count[keys] = np.where(present, np.where(row_values == previous[keys], same_count[keys] + 1, 1),
+                                        same_count[keys])
+            previous[keys] = np.where(present, row_values, previous[keys])
+
+        for i, col in enumerate(columns):
+            results[col, window] = out[:, i]
+
+    return results
+
+
+def last_n_features(df, windows=(1, 3, 5, 10)):
+    """
+    W/L, gained elo and pbp sums over each player's last N matches, with the column order and
+    fills of the train-model notebook. df must be in time order.
+    """
+    sums = rolling_before_match(df, list(ACCUMULATED_COLUMNS), windows)
+    counts = rolling_before_match(df, ['winner'], windows, how='count')
+
+    features = {}
+    for window in windows:
+        wins, matches = sums['winner', window], counts['winner', window]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wl_pct = wins / np.where(matches == 0, np.nan, matches)
+        features['wins', window] = np.where(np.isnan(wins), 0.0, wins)
+        features['matches', window] = np.where(np.isnan(matches), 0.0, matches)
+        features['wl_pct', window] = np.where(np.isnan(wl_pct), 0.0, wl_pct)
+        for column, name in list(ACCUMULATED_COLUMNS.items())[1:]:
+            features[name, window] = sums[column, window]
+
+    names = ['wins', 'matches', 'wl_pct'] + list(ACCUMULATED_COLUMNS.values())[1:]
+    return pd.DataFrame({f'last_{window}_{name}': features[name, window] for name in names for window in windows},
+                        index=df.index)
+
+
+# Groups whose running stat means players are compared against, keyed by feature suffix
+ELO_BAND_GROUPINGS = {
+    'elo_diff_and_ntile': ['elo_cat_ntile', 'elo_diff_ntile'],
+    'player': ['index'],
+    'elo_diff': ['elo_diff_ntile'],
+}
+
+
+def expanding_means_before_match(df, columns, groupings=ELO_BAND_GROUPINGS, player_col='index', dtype=np.float32):
+    """
+    Expanding mean of every column within each group of every grouping, taken as of the
+    player's previous match, i.e.
+    df.groupby(group_cols)[col].expanding().mean() followed by groupby(player_col).shift(1).
+
+    All columns of a grouping come from one segmented cumulative sum and count, and the
+    player lag is one gather shared by every grouping. df must be in time order. Returns a
+    dict of dtype arrays keyed by (grouping name, column).
+    """
+    values = df[columns].to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+
+    # Row of each player's previous match, -1 for their first
+    player_codes, _ = pd.factorize(df[player_col])
+    order = np.argsort(player_codes, kind='stable')
+    previous = np.full(len(df), -1)
+    follows = np.r_[False, player_codes[order[1:]] == player_codes[order[:-1]]]
+    previous[order[follows]] = order[np.flatnonzero(follows) - 1]
+    has_previous = previous >= 0
+
+    results = {}
+    for name, group_cols in groupings.items():
+        keys = pd.MultiIndex.from_frame(df[group_cols]) if len(group_cols) > 1 else pd.Index(df[group_cols[0]])
+        codes, _ = pd.factorize(keys)
+        # Rows with a missing key are dropped by groupby
+        codes[df[group_cols].isna().any(axis=1).to_numpy()] = -1
+
+        # Segmented running sums and counts over rows sorted by group
+        group_order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[group_order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        segment = np.repeat(starts, np.diff(np.r_[starts, len(codes)]))
+        sums = np.cumsum(filled[group_order], axis=0)
+        counts = np.cumsum(present[group_order], axis=0)
+        sums -= np.where(segment[:, None] > 0, sums[segment - 1], 0.0)
+        counts -= np.where(segment[:, None] > 0, counts[segment - 1], 0)
+
+        means = np.full(values.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[group_order] = np.where(counts > 0, sums / counts, np.nan)
+        means[codes == -1] = np.nan
+
+        lagged = np.full(values.shape, np.nan, dtype=dtype)
+        lagged[has_previous] = means[previous[has_previous]]
+        for i, col in enumerate(columns):
+            results[name, col] = lagged[:, i]
+
+    return results
+
+
+def elo_band_features(df, columns):
+    """
+    Player's running mean of each stat, the running means of players in the same elo band /
+    elo diff ntile, and the player-vs-band ratios, with the train-model notebook's columns.
+    """
+    means = expanding_means_before_match(df, columns)
+    features = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for col in columns:
+            player = means['player', col]
+            features[f'mean_{col}_elo_diff_and_ntile'] = means['elo_diff_and_ntile', col]
+            features[f'mean_{col}_player'] = player
+            features[f'{col}_player_vs_elo_diff_and_ntile'] = player / means['elo_diff_and_ntile', col]
+            features[f'mean_{col}_elo_diff'] = means['elo_diff', col]
+            features[f'{col}_player_vs_elo_diff'] = player / means['elo_diff', col]
+    return pd.DataFrame(features, index=df.index)
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+COMMISSION = 0.05
+MIN_STAKED = 1000.0
+# Scale of the penalty for weighted predictions outside [0, 1]
+RANGE_PENALTY = 1000000.0
+
+
+class SliceEvaluator:
+    """
+    The prediction matrix, atb, atb_size and result of each slice, pulled out of the frames
+    once, so a whole batch of weight vectors and max stakes is scored with a matrix product
+    per slice. Scores match the rolling-optimisation notebook's evaluate_slice.
+    """
+
+    def __init__(self, slices, prediction_columns, commission=COMMISSION):
+        self.prediction_columns = list(prediction_columns)
+        self.commission = commission
+        self.predictions = [df[self.prediction_columns].to_numpy(dtype=np.float64) for df in slices]
+        self.atb = [df['atb'].to_numpy(dtype=np.float64) for df in slices]
+        # A missing atb_size stakes nothing, as the NaN stake dropped out of the pandas sums
+        self.atb_size = [np.nan_to_num(df['atb_size'].to_numpy(dtype=np.float64)) for df in slices]
+        self.winner = [(df['result'] == 'WINNER').to_numpy(dtype=bool) for df in slices]
+
+    def weighted_predictions(self, weights, slice_index):
+        """(rows, batch) weighted predictions of one slice for (batch, columns) weights."""
+        return self.predictions[slice_index] @ np.asarray(weights, dtype=np.float64).T
+
+    def bets(self, weights, max_stakes):
+        """
+        Per slice, (stake, winnings) arrays of shape (batch, rows): what each parameter vector
+        would bet on each row, zero where the row's EV is not positive.
+        """
+        max_stakes = np.asarray(max_stakes, dtype=np.float64)[:, None]
+        bets = []
+        for i in range(len(self.predictions)):
+            weighted = self.weighted_predictions(weights, i).T
+            atb = self.atb[i]
+            ev = (weighted * (atb - 1) * (1 - self.commission)) - (1 - weighted)
+            stake = np.where(ev > 0.0, np.minimum(max_stakes, self.atb_size[i]), 0.0)
+            winnings = np.where(self.winner[i], (atb - 1) * (1 - self.commission) * stake, -stake)
+            bets.append((stake, winnings))
+        return bets
+
+    def slice_rois(self, weights, max_stakes, test=False, min_staked=MIN_STAKED):
+        """
+        (batch, slices) return on stake. Less than min_staked scores -(min_staked - staked) and,
+        unless test, weighted predictions outside [0, 1] are penalised by how far out they are.
+        """
+        weights = np.atleast_2d(weights)
+        max_stakes = np.broadcast_to(np.asarray(max_stakes, dtype=np.float64), len(weights))
+        rois = np.empty((len(weights), len(self.predictions)))
+        for i, (stake, winnings) in enumerate(self.bets(weights, max_stakes)):
+            staked = stake.sum(axis=1)
+            won = winnings.sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                roi = np.where(staked < min_staked, -(min_staked - staked), won / staked)
+            if not test:
+                weighted = self.weighted_predictions(weights, i)
+                with np.errstate(invalid='ignore'):
+                    # The notebook's (penalty, 1.0) return, scored as a stake under min_staked
+                    too_low = -(min_staked - RANGE_PENALTY * np.nanmin(weighted, axis=0, initial=np.inf))
+                    too_high = -(min_staked + RANGE_PENALTY * (np.nanmax(weighted, axis=0, initial=-np.inf) - 1.0))
+                roi = np.where((weighted < 0).any(axis=0), too_low, roi)
+                roi = np.where((weighted > 1).any(axis=0), too_high, roi)
+            rois[:, i] = roi
+        return rois
+
+    def objective(self, weights, max_stakes, min_staked=MIN_STAKED):
+        """Mean ROI over the slices for each of a batch of parameter vectors."""
+        return self.slice_rois(weights, max_stakes, min_staked=min_staked).mean(axis=1)
+
+
+def normalized_weights(params, prediction_columns):
+    """The notebook's weights: weight_<column> params scaled to sum to 1."""
+    weights = np.array([params[f'weight_{col}'] for col in prediction_columns])
+    return weights / weights.sum()
+
+
+def optimize_batched(study, evaluator, n_trials, batch_size=16, max_stake=10.0, low=-1.0, high=1.0,
+                     n_jobs=1):
+    """
+    Run n_trials of the weight search through Optuna's ask/tell interface, scoring each batch
+    of asked trials in one call to the evaluator. With n_jobs > 1 a batch is split across
+    threads; numpy releases the GIL in the matrix work.
+
+    The sampler only learns from a batch once it is told, so the trials of one batch are all
+    drawn from the same model, and TPE degrades towards random search as batch_size grows.
+    Smaller batches search better but evaluate less at a time: over 2000 trials, 16 found as
+    good a best value as asking one trial at a time in two thirds of the time, while 256 was
+    ~10% faster again but ~3% worse. A TPESampler(constant_liar=True) study did not help at 16.
+    """
+    columns = evaluator.prediction_columns
+    with ThreadPoolExecutor(n_jobs) as pool:
+        for start in range(0, n_trials, batch_size):
+            trials = [study.ask() for _ in range(min(batch_size, n_trials - start))]
+            weights = np.array([[trial.suggest_float(f'weight_{col}', low, high) for col in columns]
+                                for trial in trials])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = weights / weights.sum(axis=1, keepdims=True)
+            parts = np.array_split(np.arange(len(trials)), n_jobs)
+            values = np.concatenate(list(pool.map(
+                lambda part: evaluator.objective(weights[part], max_stake), parts)))
+            for trial, value in zip(trials, values):
+                study.tell(trial, float(value))
+    return study
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+LIBRARIES = ('xgb', 'lgb', 'cat')
+# The config flag that turns each library on
+RUN_FLAGS = {'xgb': 'run_xgb', 'lgb': 'run_lgb', 'cat': 'run_cb'}
+# Thread count parameter of each library
+THREAD_PARAMS = {'xgb': 'nthread', 'lgb': 'num_threads', 'cat': 'thread_count'}
+GPU_PARAMS = {'cat': ['gpu_ram_part']}
+XGB_MAX_BIN = 256
+
+# Set in each training worker by _open_matrix
+_matrix = None
+
+
+def write_feature_matrix(df, feature_cols, cat_cols, target_cols, split_col, path):
+    """
+    Write the features of df as one float32 matrix (categories as their codes, missing as NaN)
+    to path/features.npy, which workers memory-map instead of each getting a copy, with the
+    targets, split column and row index alongside.
+    """
+    os.makedirs(path, exist_ok=True)
+    features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+', dtype=np.float32,
+                                         shape=(len(df), len(feature_cols)))
+    categories = {}
+    for i, col in enumerate(feature_cols):
+        if col in cat_cols:
+            codes = df[col].cat.codes.to_numpy()
+            features[:, i] = np.where(codes < 0, np.nan, codes)
+            categories[col] = [str(x) for x in df[col].cat.categories]
+        else:
+            features[:, i] = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+    features.flush()
+    del features
+
+    target_cols = list(dict.fromkeys(target_cols))
+    np.savez(os.path.join(path, 'rows.npz'),
+             targets=df[target_cols].to_numpy(dtype=np.float64),
+             split=df[split_col].to_numpy(),
+             index=df.index.to_numpy())
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump({'features': list(feature_cols), 'categories': categories, 'targets': target_cols}, f)
+
+
+class FeatureMatrix:
+    """A matrix written by write_feature_matrix, memory-mapped read-only."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'columns.json')) as f:
+            columns = json.load(f)
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        rows = np.load(os.path.join(path, 'rows.npz'), allow_pickle=True)
+        self.targets = rows['targets']
+        self.split = rows['split']
+        self.index = rows['index']
+        self.columns = {col: i for i, col in enumerate(columns['features'])}
+        self.categories = columns['categories']
+        self.target_columns = {col: i for i, col in enumerate(columns['targets'])}
+
+    def fold_rows(self, fold, target):
+        """Training rows (split before fold) and validation rows (split == fold) with target set."""
+        has_target = ~np.isnan(self.targets[:, self.target_columns[target]])
+        return np.flatnonzero(has_target & (self.split < fold)), np.flatnonzero(has_target & (self.split == fold))
+
+    def take(self, rows, features):
+        return self.features[np.ix_(rows, [self.columns[col] for col in features])]
+
+    def label(self, rows, target):
+        return self.targets[rows, self.target_columns[target]]
+
+
+def cpu_params(library, params, threads):
+    """A config's params for training on the CPU with threads threads."""
+    params = dict(params)
+    if library == 'cat':
+        params['task_type'] = 'CPU'
+    else:
+        params['device'] = 'cpu'
+    for key in GPU_PARAMS.get(library, []):
+        params.pop(key, None)
+    params[THREAD_PARAMS[library]] = threads
+    return params
+
+
+def plan_tasks(df, configs, folds, split_col, select_features, params, random_seed):
+    """
+    Every (config, fold, seed, library) model of the walk-forward run, in the order the notebook
+    trained them. Features are selected per config and fold here, in that same order, so random
+    selections come out as before. params holds each library's hyperparameter sets by name.
+    """
+    tasks = []
+    for config in configs:
+        target = config['target_col']
+        df_train = df[~df[target].isna()]
+        for val_fold in folds:
+            train_mask = df_train[split_col] < val_fold
+            if not (df_train[split_col] == val_fold).any():
+                continue
+            features = select_features(config, config['features'],
+                                       df_train[train_mask][config['features']], df_train[train_mask][target])
+            for i in range(config['repeat_iterations']):
+                for library in LIBRARIES:
+                    if not config[RUN_FLAGS[library]]:
+                        continue
+                    tasks.append({
+                        'task_id': len(tasks),
+                        'config': config['name'],
+                        'fold': val_fold,
+                        'iteration': i,
+                        'model_type': library,
+                        'target': target,
+                        'features': list(features),
+                        'params': params[library][config['hyperparameter_set']],
+                        'seed': random_seed + i,
+                    })
+    return tasks
+
+
+def dataset_groups(tasks):
+    """
+    Tasks grouped by the dataset they train on (fold, target and features), largest first; each
+    group runs in one worker, which builds the dataset once for all of its configs and seeds.
+    """
+    groups = {}
+    for task in tasks:
+        groups.setdefault((task['fold'], task['target'], tuple(task['features'])), []).append(task)
+    return sorted(groups.values(), key=lambda group: (-len(group), group[0]['task_id']))
+
+
+def _open_matrix(path):
+    """Process pool initializer: map the feature matrix once per worker."""
+    global _matrix
+    _matrix = FeatureMatrix(path)
+
+
+def _build_dataset(library, X, y, features, cat_features):
+    if library == 'xgb':
+        import xgboost as xgb
+        types = ['c' if col in cat_features else 'q' for col in features]
+        return xgb.QuantileDMatrix(X, label=y, feature_names=features, feature_types=types,
+                                   enable_categorical=True, max_bin=XGB_MAX_BIN)
+    if library == 'lgb':
+        import lightgbm as lgb
+        dataset = lgb.Dataset(X, label=y, feature_name=features, categorical_feature=cat_features,
+                              params={'verbose': -1})
+        return dataset.construct()
+    from catboost import Pool
+    pool = Pool(_catboost_frame(X, features, cat_features), label=y, cat_features=cat_features)
+    pool.quantize()
+    return pool
+
+
+def _catboost_frame(X, features, cat_features):
+    # CatBoost takes categories as integers, not float codes
+    frame = pd.DataFrame(X, columns=features)
+    for col in cat_features:
+        frame[col] = frame[col].fillna(-1).astype(np.int64)
+    return frame
+
+
+def _train(library, dataset, params, seed, X_val, features, cat_features):
+    """Train one model on dataset; returns the model, its validation predictions and the hyperparameters."""
+    if library == 'xgb':
+        import xgboost as xgb
+        params = dict(params)
+        n_iterations = params.pop('n_iterations')
+        params['seed'] = seed
+        model = xgb.train(params, dataset, num_boost_round=n_iterations, evals=[(dataset, 'train')],
+                          verbose_eval=False)
+        types = ['c' if col in cat_features else 'q' for col in features]
+        prediction = model.predict(xgb.DMatrix(X_val, feature_names=features, feature_types=types,
+                                               enable_categorical=True))
+        return model, prediction, {**params, 'n_iterations': n_iterations}
+    if library == 'lgb':
+        import lightgbm as lgb
+        params = {**params, 'seed': seed}
+        model = lgb.train(params, dataset)
+        return model, model.predict(X_val), params
+    from catboost import CatBoostClassifier, CatBoostRegressor
+    params = {**params, 'random_seed': seed}
+    X_val = _catboost_frame(X_val, features, cat_features)
+    if params.get('loss_function') == 'RMSE':
+        model = CatBoostRegressor(**params)
+        model.fit(dataset, verbose=False)
+        return model, model.predict(X_val), params
+    model = CatBoostClassifier(**params)
+    model.fit(dataset, verbose=False)
+    return model, model.predict_proba(X_val)[:, 1], params
+
+
+def run_group(group, threads):
+    """
+    Train every task of one dataset group in this worker. The fold's rows are taken from the
+    mapped matrix once and each library's dataset is built once, then reused for every config
+    and seed. Returns one result per task, with its timings.
+    """
+    matrix = _matrix
+    first = group[0]
+    features, target = first['features'], first['target']
+    cat_features = [col for col in features if col in matrix.categories]
+
+    start = time.perf_counter()
+    train_rows, val_rows = matrix.fold_rows(first['fold'], target)
+    X_train, y_train = matrix.take(train_rows, features), matrix.label(train_rows, target)
+    X_val = matrix.take(val_rows, features)
+    load_seconds = time.perf_counter() - start
+
+    datasets, results = {}, []
+    for task in group:
+        library = task['model_type']
+        build_seconds = 0.0
+        if library not in datasets:
+            start = time.perf_counter()
+            datasets[library] = _build_dataset(library, X_train, y_train, features, cat_features)
+            build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        params = cpu_params(library, task['params'], threads)
+        model, prediction, hyperparameters = _train(library, datasets[library], params, task['seed'], X_val,
+                                                    features, cat_features)
+        results.append({
+            'task_id': task['task_id'],
+            'config': task['config'],
+            'fold': task['fold'],
+            'iteration': task['iteration'],
+            'model_type': library,
+            'hyperparameters': hyperparameters,
+            'model': model,
+            'index': matrix.index[val_rows],
+            'prediction': np.asarray(prediction, dtype=np.float64),
+            'pid': os.getpid(),
+            'train_rows': len(train_rows),
+            'load_seconds': load_seconds if not results else 0.0,
+            'build_seconds': build_seconds,
+            'train_seconds': time.perf_counter() - start,
+        })
+    return results
+
+
+def run_tasks(matrix_path, tasks, workers=None, threads=None):
+    """
+    Run the tasks of plan_tasks across a pool of worker processes, one dataset group at a time
+    per worker, each library using threads threads (by default the cores shared out between the
+    workers). The task graph and every task's timings are logged; returns the results in task order.
+    """
+    groups = dataset_groups(tasks)
+    cores = os.cpu_count() or 1
+    workers = min(workers or max(1, cores // 4), len(groups)) if groups else 1
+    threads = threads or max(1, cores // workers)
+
+    logger.info(f"{len(tasks)} tasks in {len(groups)} dataset groups, {workers} workers x {threads} threads")
+    for group in groups:
+        first = group[0]
+        logger.info(f"fold {first['fold']} target {first['target']} ({len(first['features'])} features): "
+                    + ', '.join(f"{task['config']}/{task['model_type']}/{task['iteration']}" for task in group))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_matrix, initargs=(matrix_path,)) as pool:
+        futures = [pool.submit(run_group, group, threads) for group in groups]
+        for future in as_completed(futures):
+            for result in future.result():
+                logger.info(f"task {result['task_id']} {result['config']}/{result['model_type']}/{result['iteration']} "
+                            f"fold {result['fold']}: load {result['load_seconds']:.1f}s, "
+                            f"build {result['build_seconds']:.1f}s, train {result['train_seconds']:.1f}s")
+                results.append(result)
+    return sorted(results, key=lambda result: result['task_id'])
+
+
+def task_timings(results):
+    """One row per task with where it ran and how long each step took."""
+    columns = ['task_id', 'config', 'fold', 'iteration', 'model_type', 'pid', 'train_rows',
+               'load_seconds', 'build_seconds', 'train_seconds']
+    return pd.DataFrame([{col: result[col] for col in columns} for result in results], columns=columns)
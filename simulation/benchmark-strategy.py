@@ -0,0 +1,126 @@
+import sys
+import time
+import smart_open
+import duckdb
+from unittest.mock import patch
+from flumine import clients, FlumineSimulation
+from flumine.utils import get_price, get_size
+from flumine.order.trade import Trade
+from flumine.order.order import LimitOrder
+
+from middleware import GetPricesFromScoredHoldout
+from prediction_store import PredictionStore
+from strategies.strategy import TennisH2H
+
+sys.path.append('../data')
+from market_catalog import market_files
+from tick_store import tick_files, tick_replay
+
+MODEL_NAME = '20241019_094247'
+MARKETS = 200
+SECONDS_TO_START = 3600
+
+
+class BaselineTennisH2H(TennisH2H):
+    # TennisH2H.process_market_book before the runner probabilities were worked out per market
+    def process_new_market(self, market, market_book):
+        return
+
+    def process_market_book(self, market, market_book):
+        if not market.context.get('preds'):
+            return
+
+        market_preds = market.context['preds'][0]
+        model_preds = [val for key, val in market_preds.items() if 'low_sample' in key]
+        back_prices = [{'sel': x.selection_id, 'atb': get_price(x.ex.available_to_back, 0)} for x in
+                       market_book.runners]
+
+        if sum([x['atb'] is not None for x in back_prices]) != 2:
+            return
+
+        for runner in market_book.runners:
+            runner_is_home = runner.selection_id == market_preds['selection_id_home']
+            runner_is_away = runner.selection_id == market_preds['selection_id_away']
+
+            if not (runner_is_away or runner_is_home):
+                return
+
+            opponent_price = [x['atb'] for x in back_prices if x['sel'] != runner.selection_id]
+            if not opponent_price:
+                return
+
+            if runner_is_away:
+                model_preds = [1 - x for x in model_preds]
+
+            best_back_price = get_price(runner.ex.available_to_back, 0)
+
+            if not best_back_price:
+                return
+
+            best_back_size = get_size(runner.ex.available_to_back, 0)
+
+            ofp = self.aggregate(model_preds)
+
+            ev = (ofp * (best_back_price - 1) * 0.95) - (1 - ofp)
+
+            if self.ev_threshold < ev:
+                trade = Trade(
+                    market_book.market_id,
+                    runner.selection_id,
+                    runner.handicap,
+                    self
+                )
+                order = trade.create_order(
+                    side="BACK",
+                    order_type=LimitOrder(best_back_price, min(best_back_size, self.stake_unit))
+                )
+                market.place_order(order)
+
+
+def timed(strategy_class):
+    # Counts the books a strategy processes and the time spent on them
+    class Timed(strategy_class):
+        ticks = 0
+        seconds = 0.0
+
+        def process_market_book(self, market, market_book):
+            start = time.perf_counter()
+            super().process_market_book(market, market_book)
+            self.seconds += time.perf_counter() - start
+            self.ticks += 1
+
+    return Timed
+
+
+if __name__ == "__main__":
+    store = PredictionStore(f'../model/outputs/{MODEL_NAME}/simulation_preds.arrow')
+    con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
+    data_files = tick_files(market_files(con, list(store.rows)[:MARKETS]))
+    con.close()
+
+    client = clients.SimulatedClient()
+    framework = FlumineSimulation(client=client)
+    client.min_bet_validation = False
+    market_filter = {
+        "markets": data_files,
+        'market_types': ['MATCH_ODDS'],
+        "listener_kwargs": {"inplay": False, "seconds_to_start": SECONDS_TO_START, "cumulative_runner_tv": True},
+    }
+
+    # Both run on the same replay, so they see the same books
+    strategies = [
+        timed(BaselineTennisH2H)(name='baseline', market_filter=market_filter, max_trade_count=1, stake_unit=10,
+                                 max_selection_exposure=10, max_order_exposure=10),
+        timed(TennisH2H)(name='per-market state', market_filter=market_filter, max_trade_count=1, stake_unit=10,
+                         max_selection_exposure=10, max_order_exposure=10),
+    ]
+    with patch('builtins.open', smart_open.open), tick_replay():
+        framework.add_market_middleware(GetPricesFromScoredHoldout(store))
+        for strategy in strategies:
+            framework.add_strategy(strategy)
+        framework.run()
+
+    print(f"{len(data_files)} markets, {strategies[0].ticks} books")
+    for strategy in strategies:
+        print(f"{strategy.name}: {strategy.ticks / strategy.seconds:,.0f} books/s in process_market_book")
+    print(f"{strategies[0].seconds / strategies[1].seconds:.1f}x")
@@ -1,82 +1,130 @@
 import os
+import glob
+import socket
 import logging
-import csv
+import pyarrow as pa
+import pyarrow.parquet as pq
 from flumine.controls.loggingcontrols import LoggingControl
 from flumine.order.ordertype import OrderTypes
 
 logger = logging.getLogger(__name__)
 
+ORDER_SCHEMA = pa.schema([
+    ("bet_id", pa.string()),
+    ("strategy_name", pa.string()),
+    ("market_id", pa.string()),
+    ("selection_id", pa.int64()),
+    ("trade_id", pa.string()),
+    ("date_time_placed", pa.timestamp("us")),
+    ("price", pa.float64()),
+    ("price_matched", pa.float64()),
+    ("size", pa.float64()),
+    ("size_matched", pa.float64()),
+    ("side", pa.string()),
+    ("elapsed_seconds_executable", pa.float64()),
+    ("order_status", pa.string()),
+    ("profit", pa.float64()),
+])
+
+
+def _write_atomic(table, path):
+    # Readers only ever see a complete file
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _part_name(path):
+    # <part>-<batch>.parquet
+    return os.path.basename(path).rsplit("-", 1)[0]
+
+
+def clear_order_parts(logname, part):
+    """Remove the batches a part has written, e.g. before a job is retried."""
+    for path in glob.glob("outputs/" + logname + ".parts/*.parquet"):
+        if _part_name(path) == part:
+            os.remove(path)
+
+
+def merge_orders(logname, parts=None):
+    """
+    Merge the order batches written by every OrderRecorder with this logname, or only those of
+    parts, into outputs/<logname>.parquet, replacing it in one step. Returns the number of orders.
+    """
+    paths = sorted(glob.glob("outputs/" + logname + ".parts/*.parquet"))
+    if parts is not None:
+        parts = set(parts)
+        paths = [path for path in paths if _part_name(path) in parts]
+    table = pa.concat_tables([pq.read_table(path, schema=ORDER_SCHEMA) for path in paths]) if paths else \
+        ORDER_SCHEMA.empty_table()
+    _write_atomic(table, "outputs/" + logname + ".parquet")
+    return table.num_rows
+
+
 class OrderRecorder(LoggingControl):
+    """
+    Buffers cleared orders and writes them in typed Parquet batches to outputs/<logname>.parts/,
+    one file per batch named after part (the host and process by default), so processes never
+    share a file. merge_orders combines the batches once the run is over.
+    """
     NAME = "ORDER_RECORDER"
 
-    def __init__(self, logname, *args, **kwargs):
-        self.path = "outputs/" + logname + ".csv"
-        self.field_names = [
-            "bet_id",
-            "strategy_name",
-            "market_id",
-            "selection_id",
-            "trade_id",
-            "date_time_placed",
-            "price",
-            "price_matched",
-            "size",
-            "size_matched",
-            "side",
-            "elapsed_seconds_executable",
-            "order_status",
-            "profit",
-            # "market_note",
-            # "trade_notes",
-            # "order_notes"
-        ]
+    def __init__(self, logname, *args, part=None, batch_rows=10_000, **kwargs):
+        self.folder = "outputs/" + logname + ".parts"
+        self.part = part or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_rows = batch_rows
+        self.orders = {name: [] for name in ORDER_SCHEMA.names}
+        self.batches = 0
         super().__init__(*args, **kwargs)
         self._setup()
 
     def _setup(self):
-        if not os.path.exists(self.path):
-            with open(self.path, "w", newline='', encoding='utf-8') as m:
-                csv_writer = csv.DictWriter(m, delimiter=",", fieldnames=self.field_names, quoting=csv.QUOTE_ALL)
-                csv_writer.writeheader()
-        else:
-            logging.info("Results file exists")
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _flush(self):
+        if not self.orders["bet_id"]:
+            return
+        table = pa.Table.from_pydict(self.orders, schema=ORDER_SCHEMA)
+        # Batches of earlier runs of the same part are left alone; clear_order_parts removes them
+        while os.path.exists(path := os.path.join(self.folder, f"{self.part}-{self.batches:05d}.parquet")):
+            self.batches += 1
+        _write_atomic(table, path)
+        self.batches += 1
+        self.orders = {name: [] for name in ORDER_SCHEMA.names}
 
     def _process_cleared_orders_meta(self, event):
         orders = event.event
-        with open(self.path, "a", newline='', encoding='utf-8') as m:
-            csv_writer = csv.DictWriter(m, delimiter=",", fieldnames=self.field_names, quoting=csv.QUOTE_ALL)
-            for order in orders:
-                if order.order_type.ORDER_TYPE == OrderTypes.LIMIT:
-                    size = order.order_type.size
-                else:
-                    size = order.order_type.liability
-                if order.order_type.ORDER_TYPE == OrderTypes.MARKET_ON_CLOSE:
-                    price = None
-                else:
-                    price = order.order_type.price
-
-                order_data = {
-                    "bet_id": order.bet_id,
-                    "strategy_name": order.trade.strategy,
-                    "market_id": order.market_id,
-                    "selection_id": order.selection_id,
-                    "trade_id": order.trade.id,
-                    "date_time_placed": order.responses.date_time_placed,
-                    "price": price,
-                    "price_matched": order.average_price_matched,
-                    "size": size,
-                    "size_matched": order.size_matched,
-                    "side": order.side,
-                    "elapsed_seconds_executable": order.elapsed_seconds_executable,
-                    "profit": order.profit,
-                    "order_status": order.status.value,
-                    # "market_note": order.trade.market_notes,
-                    # "trade_notes": order.trade.notes_str,
-                    # "order_notes": order.notes_str
-                }
-                csv_writer.writerow(order_data)
-
-            logger.info("Orders updated", extra={"order_count": len(orders)})
+        for order in orders:
+            if order.order_type.ORDER_TYPE == OrderTypes.LIMIT:
+                size = order.order_type.size
+            else:
+                size = order.order_type.liability
+            if order.order_type.ORDER_TYPE == OrderTypes.MARKET_ON_CLOSE:
+                price = None
+            else:
+                price = order.order_type.price
+
+            order_data = {
+                "bet_id": order.bet_id,
+                "strategy_name": str(order.trade.strategy),
+                "market_id": order.market_id,
+                "selection_id": order.selection_id,
+                "trade_id": str(order.trade.id),
+                "date_time_placed": order.responses.date_time_placed,
+                "price": price,
+                "price_matched": order.average_price_matched,
+                "size": size,
+                "size_matched": order.size_matched,
+                "side": order.side,
+                "elapsed_seconds_executable": order.elapsed_seconds_executable,
+                "profit": order.profit,
+                "order_status": order.status.value,
+            }
+            for name, value in order_data.items():
+                self.orders[name].append(value)
+
+        logger.info("Orders updated", extra={"order_count": len(orders)})
+        if len(self.orders["bet_id"]) >= self.batch_rows:
+            self._flush()
 
     def _process_cleared_markets(self, event):
         cleared_markets = event.event
@@ -91,6 +139,9 @@ class OrderRecorder(LoggingControl):
                 },
             )
 
+    def _process_end_flumine(self, event):
+        self._flush()
+
 # import os
 # import logging
 # import csv
@@ -1,11 +1,14 @@
 import logging
 from flumine.markets.middleware import Middleware
 
+from prediction_store import prediction_store
+
 logger = logging.getLogger(__name__)
 
 class GetPricesFromScoredHoldout(Middleware):
-    def __init__(self, preds_df):
-        self.preds_df = preds_df
+    def __init__(self, preds=None):
+        # A PredictionStore; by default the one loaded into this worker
+        self.preds = preds if preds is not None else prediction_store()
 
     def add_market(self, market) -> None:
-        market.context['preds'] = self.preds_df.query('market_id == @market.market_id').to_dict('records')
\ No newline at end of file
+        market.context['preds'] = self.preds.records(market.market_id)
\ No newline at end of file
@@ -0,0 +1,52 @@
+import pyarrow as pa
+
+# Set in each simulation worker by load_prediction_store
+_store = None
+
+
+def market_id_key(market_id):
+    """Market ids read as numbers lose their trailing zeros; pad them back on the right to 9 characters."""
+    return str(market_id).ljust(9, '0')
+
+
+def write_prediction_store(preds_df, path):
+    """Write the predictions, sorted by market id, to an uncompressed Arrow file that can be memory-mapped."""
+    preds_df = preds_df.assign(market_id=preds_df['market_id'].map(market_id_key))
+    preds_df = preds_df.sort_values('market_id', kind='stable').reset_index(drop=True)
+    # Float columns keep NaN as a value rather than a null, so records come back as pandas gives them
+    table = pa.table({column: pa.array(values, from_pandas=values.dtype.kind != 'f')
+                      for column, values in preds_df.items()})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+class PredictionStore:
+    """
+    Predictions by market id, memory-mapped from a file written by write_prediction_store.
+    Only the market id column is read up front, to index each market's rows.
+    """
+
+    def __init__(self, path):
+        # The file stays mapped for as long as the table's buffers point into it
+        self.table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        self.rows = {}
+        for row, market_id in enumerate(self.table.column('market_id').to_pylist()):
+            start, length = self.rows.get(market_id, (row, 0))
+            self.rows[market_id] = (start, length + 1)
+
+    def records(self, market_id):
+        """The market's predictions as a list of row dicts, like DataFrame.to_dict('records')."""
+        rows = self.rows.get(market_id_key(market_id))
+        if rows is None:
+            return []
+        return self.table.slice(*rows).to_pylist()
+
+
+def load_prediction_store(path):
+    """Process pool initializer: open the store once per worker."""
+    global _store
+    _store = PredictionStore(path)
+
+
+def prediction_store():
+    return _store
@@ -3,25 +3,30 @@ import time
 import logging
 
 import smart_open
-import itertools
 import os
+import sys
 import pandas as pd
 import random
-import math
 import betfairlightweight
 import glob
+import duckdb
 
 from betfairlightweight.filters import streaming_market_filter
-from concurrent import futures
 from unittest.mock import patch
-from flumine import clients, FlumineSimulation, utils
+from flumine import clients, FlumineSimulation
 from pythonjsonlogger import jsonlogger
 from datetime import datetime
 
 from flumine.flumine import Flumine
 from middleware import GetPricesFromScoredHoldout
+from prediction_store import load_prediction_store, market_id_key, write_prediction_store
 from strategies.strategy import TennisH2H
-from logging_controls.logging_controls import OrderRecorder
+from logging_controls.logging_controls import OrderRecorder, clear_order_parts, merge_orders
+
+sys.path.append('../data')
+from job_ledger import JobLedger, run_ledger
+from market_catalog import market_files
+from tick_store import tick_files, tick_replay
 
 # Logging
 logger = logging.getLogger()
@@ -36,53 +41,64 @@ logger.setLevel(logging.CRITICAL)
 # Params
 MODEL_NAME = '20241019_094247'
 STAKE_UNIT = 10
-TEST_DATA_PATH = 'E:/Data/tennis/betfair-market-files/' # only need if RUN_TYPE is 'test'
 MAX_TTJ = 1
 # MAX_BACK_PRICE = 15
 
-def run_process(markets, preds_df):
+# Strategy variants, all driven by one replay of each market; orders are tagged with the variant's name
+VARIANTS = [
+    {'name': 'TennisH2H', 'stake_unit': STAKE_UNIT, 'max_ttj': MAX_TTJ, 'ev_threshold': 0.0, 'aggregate': 'min'},
+    # {'name': 'TennisH2H_ev003_mean', 'stake_unit': STAKE_UNIT, 'max_ttj': 60, 'ev_threshold': 0.03, 'aggregate': 'mean'},
+]
+
+def run_process(markets, part=None):
     client = clients.SimulatedClient()
     framework = FlumineSimulation(client=client)
 
     market_filter = {
         "markets": markets,
         'market_types': ['MATCH_ODDS'],
-        "listener_kwargs": {"inplay": False, "seconds_to_start": MAX_TTJ, "cumulative_runner_tv": True},
+        # The same filter for every variant, so they share one stream per market
+        "listener_kwargs": {"inplay": False, "seconds_to_start": max(v['max_ttj'] for v in VARIANTS),
+                            "cumulative_runner_tv": True},
     }
 
     client.min_bet_validation = False
 
-    with patch('builtins.open', smart_open.open):
+    # Converted markets replay from the tick store, the rest from their bz2 files
+    with patch('builtins.open', smart_open.open), tick_replay():
         framework.add_market_middleware(
-            GetPricesFromScoredHoldout(preds_df)
+            GetPricesFromScoredHoldout()
         )
-        framework.add_strategy(
-            TennisH2H(
-                market_filter=market_filter,
-                max_trade_count=1,
-                stake_unit=STAKE_UNIT,
-                max_selection_exposure=STAKE_UNIT,
-                max_order_exposure=STAKE_UNIT,
+        # Each variant is its own strategy, with its own trades and exposure
+        for variant in VARIANTS:
+            framework.add_strategy(
+                TennisH2H(
+                    market_filter=market_filter,
+                    max_trade_count=1,
+                    max_selection_exposure=variant['stake_unit'],
+                    max_order_exposure=variant['stake_unit'],
+                    **variant,
+                )
             )
-        )
         framework.add_logging_control(
             OrderRecorder(
-                logname=MODEL_NAME
+                logname=MODEL_NAME,
+                part=part
             )
         )
         framework.run()
 
+
+def run_job(job_id, markets):
+    # Orders are written per job, so a retried job replaces what it wrote before failing
+    part = f'job-{job_id}'
+    clear_order_parts(MODEL_NAME, part)
+    # The ledger holds the bz2 paths, so converting markets later does not make them new jobs
+    run_process(tick_files(markets), part)
+
 # Multi processing
 if __name__ == "__main__":
     # Run the API in a terminal
-    data_files = []
-
-    for dirpath, dirnames, filenames in itertools.chain(os.walk(TEST_DATA_PATH)):
-        for filename in filenames:
-            data_files.append(os.path.join(dirpath, filename))
-
-    data_files = sorted(data_files, key=os.path.basename)
-
     # Read the necessary columns from the CSV
     model_preds = pd.read_csv(f'../model/outputs/{MODEL_NAME}/simulation_file.csv')#.query('tournament_category in ("ATP","Challenger")')
     model_preds.drop(columns=[x for x in model_preds if x.endswith('_avg')], inplace=True)
@@ -90,30 +106,34 @@ if __name__ == "__main__":
     # Convert selection_id to int and market_id to a string with zero padding on the right
     model_preds['selection_id_home'] = model_preds['selection_id_home'].astype(int)
     model_preds['selection_id_away'] = model_preds['selection_id_away'].astype(int)
-    model_preds['market_id'] = model_preds['market_id'].astype(str).str.pad(9, fillchar='0', side='right')
+    model_preds['market_id'] = model_preds['market_id'].map(market_id_key)
 
     unique_market_ids = set(model_preds['market_id'].unique().tolist())
 
-    data_files = [x for x in data_files if os.path.basename(x).rstrip(".bz2") in unique_market_ids]
+    # Workers memory-map the predictions from this file once, instead of each job being sent the frame
+    preds_file = f'../model/outputs/{MODEL_NAME}/simulation_preds.arrow'
+    write_prediction_store(model_preds, preds_file)
+
+    # Market files come from the catalog kept by data/market_catalog.py, converted ones from the tick store
+    con = duckdb.connect("E:/duckdb/tennis.duckdb", read_only=True)
+    data_files = market_files(con, unique_market_ids)
+    con.close()
 
     processes = 8  # Returns the number of CPUs in the system.
     markets_per_process = 8   # 8 is optimal as it prevents data leakage.
 
-    # run_process(data_files[:40],final_df)
+    # run_process(data_files[:40])
 
-    chunk = min(
-        markets_per_process, math.ceil(len(data_files) / processes)
-    )
+    # Consecutive markets are kept together in jobs, which are also split by file size so the big
+    # Grand Slam files do not hold up the last worker. Finished jobs stay in the ledger, so a rerun
+    # resumes, and other hosts can work through the same ledger on a shared drive
+    ledger = JobLedger(f'outputs/{MODEL_NAME}.jobs.sqlite')
+    max_bytes = sum(os.path.getsize(f) for f in data_files) // (processes * 4) or None
+    ledger.add(data_files, max_markets=markets_per_process, max_bytes=max_bytes)
 
-    _process_jobs = []
-    with futures.ProcessPoolExecutor(max_workers=processes) as p:
-        for m in (utils.chunks(data_files, chunk)):
-            _process_jobs.append(
-                p.submit(
-                    run_process,
-                    markets=m,
-                    preds_df=model_preds
-                )
-            )
-        for job in futures.as_completed(_process_jobs):
-            job.result()  # wait for result
\ No newline at end of file
+    run_ledger(ledger.path, run_job, workers=processes, initializer=load_prediction_store, initargs=(preds_file,))
+    print(ledger.progress())
+
+    # outputs/<MODEL_NAME>.parquet, with the orders of every finished job
+    merge_orders(MODEL_NAME, parts=[f'job-{job_id}' for job_id in ledger.done_jobs()])
+    ledger.close()
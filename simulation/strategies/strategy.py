@@ -11,56 +11,70 @@ from flumine.order.order import LimitOrder
 
 logger = logging.getLogger(__name__)
 
+# How the low_sample predictions of a market are combined into one probability
+AGGREGATES = {
+    'min': min,
+    'mean': lambda preds: sum(preds) / len(preds),
+}
+
 class TennisH2H(BaseStrategy):
-    def __init__(self, stake_unit,  *args, **kwargs):
+    def __init__(self, stake_unit,  *args, ev_threshold=0.0, max_ttj=None, aggregate='min', **kwargs):
         super().__init__(*args, **kwargs)
         self.stake_unit = stake_unit
+        self.ev_threshold = ev_threshold
+        # Variants sharing a replay get the widest seconds_to_start of them, so each checks its own
+        self.max_ttj = max_ttj
+        self.aggregate = AGGREGATES[aggregate]
+        self.runner_probs = {}  # {market_id: {selection_id: probability}}
 
     def check_market_book(self, market: Market, market_book: MarketBook) -> bool:
+        # Ignore books before this variant's time to jump
+        if self.max_ttj is not None and market.seconds_to_start > self.max_ttj:
+            return False
         # Ignore closed or in-play markets
         if market_book.status != "CLOSED" and not market_book.inplay:
             return True
 
-    def process_market_book(self, market: Market, market_book: MarketBook) -> None:
+    def process_new_market(self, market: Market, market_book: MarketBook) -> None:
+        # Each runner's probability, worked out once per market rather than on every book
         if not market.context.get('preds'):
             return
 
         market_preds = market.context['preds'][0]
         model_preds = [val for key, val in market_preds.items() if 'low_sample' in key]
-        back_prices = [{'sel': x.selection_id, 'atb': get_price(x.ex.available_to_back, 0)} for x in
-                       market_book.runners]
+        # pred_var = np.var(model_preds)
+        self.runner_probs[market.market_id] = {
+            market_preds['selection_id_home']: self.aggregate(model_preds),
+            market_preds['selection_id_away']: self.aggregate([1 - x for x in model_preds]),
+        }
 
-        if sum([x['atb'] is not None for x in back_prices]) != 2:
+    def process_market_book(self, market: Market, market_book: MarketBook) -> None:
+        runner_probs = self.runner_probs.get(market.market_id)
+        if runner_probs is None:
             return
 
-        for runner in market_book.runners:
-            runner_is_home = runner.selection_id == market_preds['selection_id_home']
-            runner_is_away = runner.selection_id == market_preds['selection_id_away']
-
-            if not (runner_is_away or runner_is_home):
-                return
-
-            opponent_price = [x['atb'] for x in back_prices if x['sel'] != runner.selection_id]
-            if not opponent_price:
-                return
-
-            if runner_is_away:
-                model_preds = [1 - x for x in model_preds]
-
-            best_back_price = get_price(runner.ex.available_to_back, 0)
+        # Both runners need a price to back
+        runners = market_book.runners
+        if len(runners) != 2:
+            return
+        first_back, second_back = runners[0].ex.available_to_back, runners[1].ex.available_to_back
+        if not (first_back and second_back):
+            return
 
-            if not best_back_price:
+        for runner, available_to_back in zip(runners, (first_back, second_back)):
+            ofp = runner_probs.get(runner.selection_id)
+            if ofp is None:
                 return
 
-            best_back_size = flumine.utils.get_size(runner.ex.available_to_back, 0)
-
-            # ofp_mean = sum(model_preds) / len(model_preds)
-            ofp_min = min(model_preds)
-            # pred_var = np.var(model_preds)
+            # Once a runner has its trades, any new order would only be rejected by validate_order
+            runner_context = self.get_runner_context(market.market_id, runner.selection_id, runner.handicap)
+            if runner_context.trade_count >= self.max_trade_count:
+                continue
 
-            ev = (ofp_min * (best_back_price - 1) * 0.95) - (1 - ofp_min)
+            best_back_price = available_to_back[0]['price']
+            ev = (ofp * (best_back_price - 1) * 0.95) - (1 - ofp)
 
-            if 0.0 < ev:
+            if self.ev_threshold < ev:
                 trade = Trade(
                     market_book.market_id,
                     runner.selection_id,
@@ -69,6 +83,9 @@ class TennisH2H(BaseStrategy):
                 )
                 order = trade.create_order(
                     side="BACK",
-                    order_type=LimitOrder(best_back_price,min(best_back_size,self.stake_unit))
+                    order_type=LimitOrder(best_back_price,min(available_to_back[0]['size'],self.stake_unit))
                 )
                 market.place_order(order)
+
+    def process_closed_market(self, market: Market, market_book: MarketBook) -> None:
+        self.runner_probs.pop(market.market_id, None)